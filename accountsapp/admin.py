@@ -1,5 +1,21 @@
 from django.contrib import admin
 from .models import Client
+from . import wallet
 
 
-admin.site.register(Client)
+@admin.register(Client)
+class ClientAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return wallet.with_balance(super().get_queryset(request).select_related('user'))
+
+    def get_object(self, request, object_id, from_field=None):
+        client = super().get_object(request, object_id, from_field)
+        if client is not None:
+            client.wallet = client.balance
+        return client
+
+    def save_model(self, request, obj, form, change):
+        # The ledger holds the balance, so an edited wallet is booked as an adjustment entry.
+        if change and 'wallet' in form.changed_data:
+            wallet.set_balance(obj.pk, obj.wallet)
+        super().save_model(request, obj, form, change)
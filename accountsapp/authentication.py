@@ -1,15 +1,106 @@
-from datetime import timedelta, datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
+from .tokens import verify_signed_token, SignedTokenError
 
 
+class TokenCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_in):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + min(self.ttl, expires_in), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+ACTIVE_USER_KEY = 'auth:user:%s'
+
+
+def active_user(user_id):
+    # Users are cached whole, so every call gets its own copy, and dropped from the cache when saved or deleted.
+    user = cache.get(ACTIVE_USER_KEY % user_id)
+    if user is None:
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        if user is None:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        remember_user(user)
+    return user
+
+
+def remember_user(user):
+    cache.set(ACTIVE_USER_KEY % user.pk, user, settings.TOKEN_CACHE_TTL)
+
+
+def forget_user(user_id):
+    cache.delete(ACTIVE_USER_KEY % user_id)
+
+
+def token_expires_at(token):
+    return token.created + timedelta(minutes=settings.TOKEN_EXPIRE_MINUTES)
+
 
 class RembyTokenAuthentication(TokenAuthentication):
     def authenticate_credentials(self, key):
+        # Only ids are kept in the token cache; the user comes from active_user, which is dropped when the user changes.
+        cached = token_cache.get(key)
+        if cached is not None:
+            user_id, created = cached
+            user = active_user(user_id)
+            return user, Token(key=key, user=user, created=created)
         user, token = super().authenticate_credentials(key)
-        time_now = (datetime.now() - timedelta(minutes = 10)).replace(tzinfo=None)
-        if token.created.replace(tzinfo=None) < time_now:
+        expires_in = (token_expires_at(token) - timezone.now()).total_seconds()
+        if expires_in <= 0:
             token.delete()
             raise exceptions.AuthenticationFailed("Your token has expired")
-        return user, token
\ No newline at end of file
+        remember_user(user)
+        token_cache.set(key, (user.pk, token.created), expires_in)
+        return user, token
+
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    keyword = 'Signed'
+
+    def authenticate_credentials(self, key):
+        try:
+            user_id, issued_at, key_id = verify_signed_token(key)
+        except SignedTokenError as error:
+            raise exceptions.AuthenticationFailed(str(error))
+        return active_user(user_id), key
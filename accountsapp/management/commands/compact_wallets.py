@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from accountsapp import wallet
+
+
+class Command(BaseCommand):
+    help = "Write wallet balance snapshots for clients with new ledger entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Clients handled per batch.')
+
+    def handle(self, *args, **options):
+        created = wallet.compact(chunk_size=options['chunk_size'])
+        self.stdout.write(f'wallet snapshots written: {created}')
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.8 on 2026-10-18 19:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_wallets(apps, schema_editor):
+    Client = apps.get_model('accountsapp', 'Client')
+    WalletEntry = apps.get_model('accountsapp', 'WalletEntry')
+    last = 0
+    while True:
+        clients = list(Client.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'wallet')[:1000])
+        if not clients:
+            break
+        WalletEntry.objects.bulk_create([
+            WalletEntry(client_id=pk, amount=wallet, kind='opening') for pk, wallet in clients
+        ])
+        last = clients[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountsapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('create_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_snapshots', to='accountsapp.client')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', '-last_entry_id'], name='accountsapp_client__1d38fa_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WalletEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('purchase', 'Purchase'), ('refund', 'Refund')], max_length=16)),
+                ('create_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_entries', to='accountsapp.client')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'id'], name='accountsapp_client__7ffd9c_idx')],
+            },
+        ),
+        migrations.RunPython(open_wallets, migrations.RunPython.noop),
+    ]
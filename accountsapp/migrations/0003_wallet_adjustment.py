@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountsapp', '0002_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='walletentry',
+            name='kind',
+            field=models.CharField(choices=[('opening', 'Opening balance'), ('purchase', 'Purchase'), ('refund', 'Refund'), ('adjustment', 'Adjustment')], max_length=16),
+        ),
+    ]
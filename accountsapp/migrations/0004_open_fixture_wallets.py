@@ -0,0 +1,32 @@
+# Generated by Django 4.2.8 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+def open_missing_wallets(apps, schema_editor):
+    # Clients loaded from fixtures before their saves were booked have no opening entry yet.
+    Client = apps.get_model('accountsapp', 'Client')
+    WalletEntry = apps.get_model('accountsapp', 'WalletEntry')
+    last = 0
+    while True:
+        clients = list(
+            Client.objects.filter(pk__gt=last).exclude(wallet_entries__kind='opening')
+            .order_by('pk').values_list('pk', 'wallet')[:1000]
+        )
+        if not clients:
+            break
+        WalletEntry.objects.bulk_create([
+            WalletEntry(client_id=pk, amount=wallet, kind='opening') for pk, wallet in clients
+        ])
+        last = clients[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountsapp', '0003_wallet_adjustment'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_missing_wallets, migrations.RunPython.noop),
+    ]
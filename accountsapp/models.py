@@ -4,7 +4,61 @@ from django.contrib.auth.models import User
 
 class Client(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # The opening balance, later a display copy refreshed by compaction; the ledger holds the balance.
     wallet = models.DecimalField(decimal_places=2, max_digits=12, default=10000)
 
     def __str__(self):
-        return f'{self.user} {self.wallet}'
\ No newline at end of file
+        return f'{self.user} {self.balance}'
+
+    @property
+    def balance(self):
+        # accountsapp.wallet.with_balance annotates it; otherwise it is read from the ledger once.
+        if not hasattr(self, '_balance'):
+            from .wallet import balance
+            self._balance = balance(self.pk)
+        return self._balance
+
+    @balance.setter
+    def balance(self, value):
+        self._balance = value
+
+class WalletEntry(models.Model):
+    OPENING = 'opening'
+    PURCHASE = 'purchase'
+    REFUND = 'refund'
+    ADJUSTMENT = 'adjustment'
+    KINDS = [
+        (OPENING, 'Opening balance'),
+        (PURCHASE, 'Purchase'),
+        (REFUND, 'Refund'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='wallet_entries')
+    amount = models.DecimalField(decimal_places=2, max_digits=12)
+    kind = models.CharField(max_length=16, choices=KINDS)
+    create_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['client', 'id'])]
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Wallet entries are append-only')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.client} {self.kind} {self.amount}'
+
+
+class WalletSnapshot(models.Model):
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='wallet_snapshots')
+    balance = models.DecimalField(decimal_places=2, max_digits=12)
+    last_entry_id = models.BigIntegerField()
+    create_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['client', '-last_entry_id'])]
+
+    def __str__(self):
+        return f'{self.client} {self.balance} at entry {self.last_entry_id}'
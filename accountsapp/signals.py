@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache, forget_user
+from .models import Client, WalletEntry
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Client)
+def open_wallet(sender, instance, created, raw=False, **kwargs):
+    # Fixtures save raw and may be loaded more than once, so their clients get one opening entry each.
+    if created or raw:
+        WalletEntry.objects.get_or_create(
+            client=instance, kind=WalletEntry.OPENING, defaults={'amount': instance.wallet},
+        )
@@ -1,7 +1,23 @@
 from django.urls import reverse_lazy
-from django.test import TestCase, Client
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.test import TestCase, SimpleTestCase, Client, override_settings
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
 from accountsapp.views import Login
+from accountsapp.authentication import RembyTokenAuthentication, SignedTokenAuthentication, TokenCache
+from accountsapp.tokens import issue_signed_token
+from accountsapp.models import Client as ShopClient, WalletEntry, WalletSnapshot
+from accountsapp import wallet
 
 
 class UnitTestLoginView(TestCase):
@@ -31,5 +47,183 @@ class IntegrationTestLoginView(TestCase):
         self.assertEqual(success_url, reverse_lazy('login_done'))
 
 
+class RembyTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = RembyTokenAuthentication()
+
+    def test_warm_token_needs_no_queries(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+
+    def test_cached_token_checks_user(self):
+        first, _ = self.authentication.authenticate_credentials(self.token.key)
+        second, token = self.authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(token.user_id, self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_deleted_token_is_forgotten(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_expired_token(self):
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(minutes=11))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+        self.assertFalse(Token.objects.filter(pk=self.token.pk).exists())
+
+    def test_obtain_token_rotates_expired_token(self):
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(minutes=11))
+        response = self.client.post('/api-token-auth/', {'username': 'testuser', 'password': 'testpassword'})
+        self.assertNotEqual(response.json()['token'], self.token.key)
+
+
+class TokenCacheTest(SimpleTestCase):
+    def test_lru_and_ttl(self):
+        cache = TokenCache(maxsize=2, ttl=60)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('d', 4, 0)
+        self.assertIsNone(cache.get('d'))
+
+
+class SignedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.authentication = SignedTokenAuthentication()
+
+    def test_verified_without_queries(self):
+        token = issue_signed_token(self.user)
+        self.authentication.authenticate_credentials(token)
+        with self.assertNumQueries(0):
+            user, auth = self.authentication.authenticate_credentials(token)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.username, 'testuser')
+
+    def test_inactive_or_deleted_user(self):
+        token = issue_signed_token(self.user)
+        self.authentication.authenticate_credentials(token)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(token)
+        self.user.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(token)
+
+    def test_tampered_token(self):
+        key_id, user_id, issued_at, nonce, signature = issue_signed_token(self.user).split('.')
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(f'{key_id}.{user_id}1.{issued_at}.{nonce}.{signature}')
+
+    def test_expired_token(self):
+        with mock.patch('accountsapp.tokens.time.time', return_value=time.time() - 11 * 60):
+            token = issue_signed_token(self.user)
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Your token has expired'):
+            self.authentication.authenticate_credentials(token)
+
+    def test_key_rotation(self):
+        token = issue_signed_token(self.user)
+        with self.settings(SIGNED_TOKEN_KEYS={'k1': 'old', 'k2': 'new'}, SIGNED_TOKEN_KEY_ID='k2'):
+            with self.settings(SIGNED_TOKEN_KEY_ID='k1'):
+                old_token = issue_signed_token(self.user)
+            new_token = issue_signed_token(self.user)
+            self.authentication.authenticate_credentials(old_token)
+            self.authentication.authenticate_credentials(new_token)
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                self.authentication.authenticate_credentials(token)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(new_token)
+
+    def test_obtain_and_revoke(self):
+        response = self.client.post('/api-token-auth/', {'username': 'testuser', 'password': 'testpassword'})
+        token = response.json()['signed_token']
+        self.authentication.authenticate_credentials(token)
+        response = self.client.delete('/api-token-auth/', {'signed_token': token}, content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Your token has been revoked'):
+            self.authentication.authenticate_credentials(token)
+
+
+class WalletFixtureTest(TestCase):
+    def test_fixture_clients_open_their_wallets(self):
+        for pk in (2, 3, 5):
+            User.objects.create_user(username=f'fixture{pk}', id=pk)
+        fixture = settings.BASE_DIR / 'shop_accountsapp__db.json'
+        call_command('loaddata', fixture, verbosity=0)
+        call_command('loaddata', fixture, verbosity=0)
+        balances = {client.pk: client.balance for client in wallet.with_balance(ShopClient.objects.all())}
+        self.assertEqual(balances, {1: Decimal('3111.00'), 2: Decimal('3436.00'), 3: Decimal('9655.00')})
+
+
+class WalletLedgerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client_instance = ShopClient.objects.create(user=self.user, wallet=100)
+
+    def test_balance_follows_wallet(self):
+        self.assertTrue(wallet.debit(self.client_instance.pk, Decimal('30')))
+        self.assertFalse(wallet.debit(self.client_instance.pk, Decimal('80')))
+        wallet.credit_many({self.client_instance.pk: Decimal('5.50')})
+        self.assertEqual(wallet.balance(self.client_instance.pk), Decimal('75.50'))
+        kinds = list(self.client_instance.wallet_entries.order_by('pk').values_list('kind', flat=True))
+        self.assertEqual(kinds, [WalletEntry.OPENING, WalletEntry.PURCHASE, WalletEntry.REFUND])
+
+    def test_debit_does_not_write_client_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            wallet.debit(self.client_instance.pk, Decimal('30'))
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')])
+        self.client_instance.refresh_from_db()
+        self.assertEqual(self.client_instance.wallet, 100)
+
+    def test_edits_are_booked_as_adjustments(self):
+        wallet.debit(self.client_instance.pk, Decimal('30'))
+        wallet.set_balance(self.client_instance.pk, Decimal('200'))
+        self.assertEqual(wallet.balance(self.client_instance.pk), 200)
+        adjustment = self.client_instance.wallet_entries.get(kind=WalletEntry.ADJUSTMENT)
+        self.assertEqual(adjustment.amount, 130)
+
+    @override_settings(WALLET_COMPACT_GRACE_SECONDS=0)
+    def test_compaction(self):
+        wallet.debit(self.client_instance.pk, Decimal('30'))
+        out = StringIO()
+        call_command('compact_wallets', stdout=out)
+        self.assertIn('wallet snapshots written: 1', out.getvalue())
+        snapshot = WalletSnapshot.objects.get(client=self.client_instance)
+        self.assertEqual(snapshot.balance, 70)
+        wallet.debit(self.client_instance.pk, Decimal('20'))
+        with self.assertNumQueries(2):
+            self.assertEqual(wallet.balance(self.client_instance.pk), 50)
+        self.assertEqual(wallet.compact(), 1)
+        self.assertEqual(wallet.compact(), 0)
+        self.assertEqual(wallet.balance(self.client_instance.pk), 50)
 
+    @override_settings(WALLET_COMPACT_GRACE_SECONDS=60)
+    def test_compaction_skips_recent_entries(self):
+        old = self.client_instance.wallet_entries.get()
+        WalletEntry.objects.filter(pk=old.pk).update(create_at=timezone.now() - timedelta(minutes=5))
+        wallet.debit(self.client_instance.pk, Decimal('30'))
+        self.assertEqual(wallet.compact(), 1)
+        self.assertEqual(WalletSnapshot.objects.get().last_entry_id, old.pk)
+        self.assertEqual(wallet.balance(self.client_instance.pk), 70)
+        self.client_instance.refresh_from_db()
+        self.assertEqual(self.client_instance.wallet, 100)
 
+    def test_entries_are_append_only(self):
+        entry = self.client_instance.wallet_entries.get()
+        entry.amount = 1000
+        with self.assertRaises(ValueError):
+            entry.save()
@@ -0,0 +1,51 @@
+import hmac
+import secrets
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import salted_hmac
+
+
+REVOKED_KEY = 'signed-token:revoked:%s'
+
+
+class SignedTokenError(Exception):
+    pass
+
+
+def _signature(key_id, payload):
+    secret = settings.SIGNED_TOKEN_KEYS[key_id]
+    return salted_hmac('accountsapp.signed-token', payload, secret=secret, algorithm='sha256').hexdigest()
+
+
+def _lifetime():
+    return settings.TOKEN_EXPIRE_MINUTES * 60
+
+
+def issue_signed_token(user):
+    key_id = settings.SIGNED_TOKEN_KEY_ID
+    payload = f'{key_id}.{user.pk}.{int(time.time())}.{secrets.token_hex(4)}'
+    return f'{payload}.{_signature(key_id, payload)}'
+
+
+def verify_signed_token(token):
+    try:
+        key_id, user_id, issued_at, nonce, signature = token.split('.')
+        user_id, issued_at = int(user_id), int(issued_at)
+    except ValueError:
+        raise SignedTokenError('Invalid token')
+    if key_id not in settings.SIGNED_TOKEN_KEYS:
+        raise SignedTokenError('Invalid token')
+    if not hmac.compare_digest(signature, _signature(key_id, f'{key_id}.{user_id}.{issued_at}.{nonce}')):
+        raise SignedTokenError('Invalid token')
+    if issued_at + _lifetime() <= time.time():
+        raise SignedTokenError('Your token has expired')
+    if cache.get(REVOKED_KEY % signature):
+        raise SignedTokenError('Your token has been revoked')
+    return user_id, issued_at, key_id
+
+
+def revoke_signed_token(token):
+    user_id, issued_at, key_id = verify_signed_token(token)
+    signature = token.rsplit('.', 1)[1]
+    cache.set(REVOKED_KEY % signature, True, timeout=max(int(issued_at + _lifetime() - time.time()), 1))
@@ -6,6 +6,9 @@ from django.urls import reverse_lazy
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
+from django.utils import timezone
+from .authentication import token_expires_at
+from .tokens import issue_signed_token, revoke_signed_token, SignedTokenError
 
 
 class Register(CreateView):
@@ -43,10 +46,21 @@ class RembyAuthToken(ObtainAuthToken):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
+        if not created and token_expires_at(token) <= timezone.now():
+            token.delete()
+            token = Token.objects.create(user=user)
         return Response({
             'attention': f'{user.username}, this is now your new token',
             'token': token.key,
+            'signed_token': issue_signed_token(user),
             'user_id': user.pk,
             'user_first_name': user.first_name,
             'user_last_name': user.last_name,
         })
+
+    def delete(self, request, *args, **kwargs):
+        try:
+            revoke_signed_token(request.data.get('signed_token', ''))
+        except SignedTokenError as error:
+            return Response({'error': str(error)}, status=400)
+        return Response(status=204)
@@ -0,0 +1,115 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Case, When, Max, Sum, OuterRef, Subquery, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Client, WalletEntry, WalletSnapshot
+
+
+MONEY = DecimalField(decimal_places=2, max_digits=12)
+
+
+def lock(client_id):
+    # Spending is serialized per client so two debits cannot both pass the same balance check;
+    # on PostgreSQL this is an advisory lock, so the Client row itself is never locked or written.
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('wallet'), %s)", [client_id])
+    else:
+        list(Client.objects.select_for_update().filter(pk=client_id).values_list('pk'))
+
+
+def debit(client_id, amount, kind=WalletEntry.PURCHASE):
+    with transaction.atomic():
+        lock(client_id)
+        if balance(client_id) < amount:
+            return False
+        WalletEntry.objects.create(client_id=client_id, amount=-amount, kind=kind)
+    return True
+
+
+def credit_many(amounts, kind=WalletEntry.REFUND):
+    WalletEntry.objects.bulk_create([
+        WalletEntry(client_id=pk, amount=amount, kind=kind) for pk, amount in amounts.items()
+    ])
+
+
+def set_balance(client_id, amount):
+    # Manual edits are booked as an adjustment entry for the difference.
+    with transaction.atomic():
+        lock(client_id)
+        difference = amount - balance(client_id)
+        if difference:
+            WalletEntry.objects.create(client_id=client_id, amount=difference, kind=WalletEntry.ADJUSTMENT)
+        Client.objects.filter(pk=client_id).update(wallet=amount)
+    return amount
+
+
+def balance(client_id):
+    snapshot = WalletSnapshot.objects.filter(client_id=client_id).order_by('-last_entry_id').first()
+    start, last_entry_id = (snapshot.balance, snapshot.last_entry_id) if snapshot else (Decimal(0), 0)
+    entries = WalletEntry.objects.filter(client_id=client_id, pk__gt=last_entry_id)
+    return start + entries.aggregate(total=Coalesce(Sum('amount'), Decimal(0)))['total']
+
+
+def with_balance(queryset):
+    latest = WalletSnapshot.objects.filter(client_id=OuterRef('pk')).order_by('-last_entry_id')
+    deltas = (
+        WalletEntry.objects.filter(client_id=OuterRef('pk'), pk__gt=OuterRef('wallet_since'))
+        .order_by().values('client_id').annotate(total=Sum('amount')).values('total')
+    )
+    return queryset.annotate(
+        wallet_since=Coalesce(Subquery(latest.values('last_entry_id')[:1]), 0),
+    ).annotate(balance=(
+        Coalesce(Subquery(latest.values('balance')[:1]), Decimal(0), output_field=MONEY)
+        + Coalesce(Subquery(deltas), Decimal(0), output_field=MONEY)
+    ))
+
+
+def compact(chunk_size=1000):
+    # Ids are taken before commit, so an entry with a lower id can still appear after a higher one.
+    # Only entries older than the grace period are snapshotted, so every id below the horizon has committed.
+    horizon = timezone.now() - timedelta(seconds=settings.WALLET_COMPACT_GRACE_SECONDS)
+    upto = WalletEntry.objects.filter(create_at__lt=horizon).aggregate(last=Max('pk'))['last'] or 0
+    latest = WalletSnapshot.objects.filter(client_id=OuterRef('client_id')).order_by('-last_entry_id')
+    created = 0
+    last_client_id = 0
+    while True:
+        client_ids = list(
+            Client.objects.filter(pk__gt=last_client_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not client_ids:
+            break
+        last_client_id = client_ids[-1]
+
+        deltas = (
+            WalletEntry.objects.filter(client_id__in=client_ids, pk__lte=upto)
+            .annotate(since=Coalesce(Subquery(latest.values('last_entry_id')[:1]), 0))
+            .filter(pk__gt=F('since'))
+            .values('client_id')
+            .annotate(total=Sum('amount'), last=Max('pk'))
+        )
+        previous = dict(
+            WalletSnapshot.objects.filter(client_id__in=client_ids, pk=Subquery(latest.values('pk')[:1]))
+            .values_list('client_id', 'balance')
+        )
+        snapshots = [
+            WalletSnapshot(
+                client_id=delta['client_id'],
+                balance=previous.get(delta['client_id'], Decimal(0)) + delta['total'],
+                last_entry_id=delta['last'],
+            )
+            for delta in deltas
+        ]
+        with transaction.atomic():
+            WalletSnapshot.objects.bulk_create(snapshots)
+            # Client.wallet is only a display copy, refreshed here off the purchase path.
+            if snapshots:
+                Client.objects.filter(pk__in=[snapshot.client_id for snapshot in snapshots]).update(wallet=Case(
+                    *[When(pk=snapshot.client_id, then=snapshot.balance) for snapshot in snapshots],
+                    default=F('wallet'),
+                ))
+        created += len(snapshots)
+    return created
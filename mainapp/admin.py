@@ -1,7 +1,17 @@
 from django.contrib import admin
 from .models import Product, Purchase, Return
+from .services import confirm_returns
+
+
+class ReturnAdmin(admin.ModelAdmin):
+    actions = ['confirm_selected']
+
+    @admin.action(description='Confirm selected returns')
+    def confirm_selected(self, request, queryset):
+        confirmed = confirm_returns(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'{confirmed} returns confirmed')
 
 
 admin.site.register(Product)
 admin.site.register(Purchase)
-admin.site.register(Return)
+admin.site.register(Return, ReturnAdmin)
@@ -0,0 +1,124 @@
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.contrib import auth
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.views.generic import View
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .conditional import conditional_response, object_validators
+from .models import Product
+from .serializers import ProductSerializer
+from .views import ProductListView, PurchaseListView, ProductModelViewSet, PurchaseModelViewSet
+from . import catalog_cache
+
+
+async def resolve_user(request):
+    # The lazy request.user would hit the session table from the event loop, so it is loaded in a thread once.
+    request.user = await sync_to_async(auth.get_user)(request)
+    return request.user
+
+
+async def resolve_api_user(request):
+    def authenticate():
+        authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        return Request(request, authenticators=authenticators).user
+    request.user = await sync_to_async(authenticate)()
+    return request.user
+
+
+def list_page(viewset, request):
+    # The sync viewset's own filter backends, cursor pagination and serializer, run in one thread hop.
+    api_request = Request(request)
+    api_request.user = request.user
+    view = viewset(request=api_request, action='list', format_kwarg=None, args=(), kwargs={})
+    page = view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+    return view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+def api_error(error):
+    return JsonResponse(error.detail, status=error.status_code, safe=False)
+
+
+class AsyncProductListView(View):
+    read_from_replica = True
+
+    async def get(self, request):
+        await resolve_user(request)
+        view = ProductListView(request=request)
+        products, next_link, previous_link = await sync_to_async(view.paginate_object_list)(Product.objects.all())
+        context = {
+            'all_product_list': products, 'next_link': next_link, 'previous_link': previous_link,
+            'query': request.GET.get('q', ''),
+        }
+        return render(request, 'products.html', context)
+
+
+class AsyncProductPageView(View):
+    read_from_replica = True
+
+    async def get(self, request, pk):
+        user = await resolve_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        try:
+            product = await Product.objects.aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404
+        return conditional_response(
+            request, object_validators(product, user.pk),
+            lambda: render(request, 'product_detail.html', {'product': product}),
+        )
+
+
+class AsyncPurchaseListView(View):
+    async def get(self, request):
+        user = await resolve_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        view = PurchaseListView(request=request)
+        purchases, next_link, previous_link = await sync_to_async(
+            lambda: view.paginate_object_list(view.get_queryset())
+        )()
+        context = {'all_purchases_list': purchases, 'next_link': next_link, 'previous_link': previous_link}
+        return render(request, 'purchases.html', context)
+
+    async def post(self, request):
+        return await sync_to_async(PurchaseListView.as_view())(request)
+
+
+class AsyncProductApiView(View):
+    read_from_replica = True
+
+    async def get(self, request, pk=None):
+        user = await resolve_api_user(request)
+        if pk is None:
+            # Same filters, cursor and catalog cache as the DRF product list.
+            try:
+                data = await sync_to_async(catalog_cache.get_or_set)(
+                    'list', request.build_absolute_uri(), lambda: list_page(ProductModelViewSet, request)
+                )
+            except APIException as error:
+                return api_error(error)
+            return JsonResponse(data)
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        try:
+            product = await sync_to_async(catalog_cache.get_or_set)('product', pk, partial(Product.objects.get, pk=pk))
+        except Product.DoesNotExist:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+        return JsonResponse(ProductSerializer(product).data)
+
+
+class AsyncPurchaseApiView(View):
+    async def get(self, request):
+        user = await resolve_api_user(request)
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        try:
+            data = await sync_to_async(list_page)(PurchaseModelViewSet, request)
+        except APIException as error:
+            return api_error(error)
+        return JsonResponse(data)
@@ -0,0 +1,42 @@
+import math
+from django.db.models import Max
+from mainapp.models import Job
+
+
+# The API router is mounted at '/', so its URLs start with '//', which the test client would read as a host.
+API_ROOT = 'http://testserver/'
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def last_job_id():
+    return Job.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def delete_jobs(since_id, product_ids):
+    # Removes the jobs a bench run queued about its own products, which it deletes when it is done.
+    product_ids = set(product_ids)
+    stale = []
+    for job in Job.objects.filter(pk__gt=since_id).only('pk', 'payload').iterator():
+        referenced = {int(line[0]) for line in job.payload.get('lines', [])}
+        if 'product_id' in job.payload:
+            referenced.add(job.payload['product_id'])
+        if referenced and referenced <= product_ids:
+            stale.append(job.pk)
+    return Job.objects.filter(pk__in=stale).delete()[0]
@@ -0,0 +1,64 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .db_router import use_primary
+
+
+VERSION_KEY = 'catalog:version'
+STATS_KEY = 'catalog:stats:%s'
+STATS = ('hits', 'misses', 'evictions')
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    # A lost version key restarts from the clock, so it never returns to a version that may still be cached.
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    _count('evictions')
+
+
+def invalidate():
+    bump_version()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump_version)
+
+
+def get_or_set(kind, key, default):
+    digest = hashlib.md5(str(key).encode()).hexdigest()
+    cache_key = f'catalog:{get_version()}:{kind}:{digest}'
+    value = cache.get(cache_key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    # A lagging replica could store rows older than the version they are cached under, so misses read the primary.
+    with use_primary():
+        value = default()
+    cache.set(cache_key, value, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    return value
+
+
+def stats():
+    data = {name: cache.get(STATS_KEY % name, 0) for name in STATS}
+    data['version'] = get_version()
+    return data
+
+
+def _count(name):
+    key = STATS_KEY % name
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
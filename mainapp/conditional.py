@@ -0,0 +1,68 @@
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def validators(stamps, *parts):
+    # Every stamp feeds both the ETag and Last-Modified, so either header alone catches a change.
+    last_modified = max([stamp for stamp in stamps if stamp is not None], default=None)
+    etag = make_etag(*parts, *[stamp.timestamp() if stamp else '' for stamp in stamps])
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def list_validators(queryset, fields=('updated_at',), *extra):
+    stats = queryset.order_by().aggregate(
+        total=Count('pk', distinct=True), **{f'max_{i}': Max(field) for i, field in enumerate(fields)}
+    )
+    return validators([stats[f'max_{i}'] for i in range(len(fields))], stats['total'], *extra)
+
+
+def object_validators(instance, *extra, stamps=()):
+    return validators([instance.updated_at, *stamps], instance._meta.label, instance.pk, *extra)
+
+
+def conditional_response(request, validators, get_response):
+    etag, last_modified = validators
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    validator_fields = ('updated_at',)
+    # Lists that every user sees the same way leave the user out of the ETag.
+    validators_per_user = True
+
+    def get_validator_fields(self, queryset):
+        return self.validator_fields
+
+    def get_object_stamps(self, instance):
+        return ()
+
+    def get_list_validators(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        extra = [self.request.user.pk] if self.validators_per_user else []
+        return list_validators(queryset, self.get_validator_fields(queryset), self.request.build_absolute_uri(), *extra)
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(request, self.get_list_validators(), lambda: self.list_response(request, *args, **kwargs))
+
+    def list_response(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return conditional_response(
+            request, object_validators(instance, stamps=self.get_object_stamps(instance)),
+            lambda: Response(self.get_serializer(instance).data),
+        )
@@ -0,0 +1,99 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Credentials, sessions and wallets are always read from the primary.
+PRIMARY_APPS = {'auth', 'authtoken', 'sessions', 'contenttypes', 'accountsapp'}
+
+replica_allowed = ContextVar('replica_allowed', default=False)
+
+
+@contextmanager
+def use_primary():
+    token = replica_allowed.set(False)
+    try:
+        yield
+    finally:
+        replica_allowed.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not replica_allowed.get() or not settings.REPLICA_DATABASES:
+            return None
+        if model._meta.app_label in PRIMARY_APPS:
+            return None
+        # Reads inside a write transaction must see its own changes.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary through replication.
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaMiddleware:
+    # Views opt in with read_from_replica = True; everything else, and any client that wrote
+    # in the last PRIMARY_PIN_SECONDS, keeps reading from the primary.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = replica_allowed.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_allowed.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = replica_allowed.set(False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_allowed.reset(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pinned_until = time.time() + settings.PRIMARY_PIN_SECONDS
+            response.set_cookie(PIN_COOKIE, f'{pinned_until:.3f}', max_age=settings.PRIMARY_PIN_SECONDS, httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+        replica_allowed.set(
+            request.method in SAFE_METHODS
+            and getattr(view_class, 'read_from_replica', False)
+            and not is_pinned(request)
+        )
@@ -1,4 +1,6 @@
+from django.db.models import Count, Q
 from rest_framework import filters
+from .serializers import ProductFilterSerializer
 
 
 class UserFilterBackend(filters.BaseFilterBackend):
@@ -6,4 +8,57 @@ class UserFilterBackend(filters.BaseFilterBackend):
         if request.user.is_superuser:
             return queryset
         else:
-            return queryset.filter(user=request.user.client)
\ No newline at end of file
+            return queryset.filter(user=request.user.client)
+
+
+class ProductFilterBackend(filters.OrderingFilter):
+    ordering_fields = ['id', 'name', 'price', 'count_in_storage']
+    price_buckets = [10, 50, 100, 500]
+
+    def filter_queryset(self, request, queryset, view):
+        params = ProductFilterSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if 'min_price' in params.validated_data:
+            queryset = queryset.filter(price__gte=params.validated_data['min_price'])
+        if 'max_price' in params.validated_data:
+            queryset = queryset.filter(price__lte=params.validated_data['max_price'])
+        if params.validated_data.get('in_stock'):
+            queryset = queryset.filter(count_in_storage__gt=0)
+
+        # Cursor positions cannot be NULL, so rows without a value drop out when ordering by it.
+        for field in self.get_ordering(request, queryset, view) or []:
+            name = field.lstrip('-')
+            if queryset.model._meta.get_field(name).null:
+                queryset = queryset.filter(**{f'{name}__isnull': False})
+        return super().filter_queryset(request, queryset, view)
+
+    def get_ordering(self, request, queryset, view):
+        # Ties are broken by id in the leading direction, so rows sharing a value keep one order across pages.
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if ordering and not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def get_facets(self, queryset):
+        bounds = [None, *self.price_buckets, None]
+        aggregates = {
+            'total': Count('pk'),
+            'in_stock': Count('pk', filter=Q(count_in_storage__gt=0)),
+        }
+        for i, (low, high) in enumerate(zip(bounds, bounds[1:])):
+            condition = Q(price__isnull=False)
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            aggregates[f'price_{i}'] = Count('pk', filter=condition)
+        counts = queryset.order_by().aggregate(**aggregates)
+        return {
+            'total': counts['total'],
+            'in_stock': counts['in_stock'],
+            'out_of_stock': counts['total'] - counts['in_stock'],
+            'price': [
+                {'min': low, 'max': high, 'count': counts[f'price_{i}']}
+                for i, (low, high) in enumerate(zip(bounds, bounds[1:]))
+            ],
+        }
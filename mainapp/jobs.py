@@ -0,0 +1,110 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Job
+
+
+logger = logging.getLogger('mainapp.jobs')
+
+TASKS = {}
+
+
+class LostLock(Exception):
+    pass
+
+
+def task(name):
+    def register(function):
+        TASKS[name] = function
+        return function
+    return register
+
+
+def enqueue(name, payload=None, priority=0, delay=0, max_attempts=5):
+    if name not in TASKS:
+        raise KeyError(f'Unknown job: {name}')
+    if settings.JOBS_EAGER:
+        # Like a queued job, an eager one only sees the caller's work once it has committed.
+        transaction.on_commit(lambda: TASKS[name](**(payload or {})))
+        return None
+    return Job.objects.create(
+        name=name, payload=payload or {}, priority=priority, max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker, batch_size=10):
+    now = timezone.now()
+    ready = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(ready.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+        else:
+            ids = list(ready.values_list('pk', flat=True)[:batch_size])
+        # Without SKIP LOCKED another worker may have read the same ids, so only the rows still queued are taken.
+        Job.objects.filter(pk__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(
+        Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker, locked_at=now)
+        .order_by('-priority', 'run_at', 'id')
+    )
+
+
+def backoff(attempts):
+    return min(settings.JOBS_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_SECONDS)
+
+
+def owned(job):
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+
+
+def run(job):
+    try:
+        # The job is marked done in the task's own transaction, and only while this run still holds
+        # the lock: a run that outlived JOBS_LOCK_TIMEOUT_SECONDS and was reclaimed is rolled back,
+        # so its work is committed by one run only.
+        with transaction.atomic():
+            TASKS[job.name](**job.payload)
+            finished = owned(job).update(status=Job.DONE, locked_by='', locked_at=None)
+            if not finished:
+                raise LostLock(job.pk)
+    except LostLock:
+        logger.warning('job %s was reclaimed while running; its work is discarded', job)
+        return False
+    except Exception as error:
+        logger.warning('job %s failed on attempt %s: %s', job, job.attempts, error)
+        done = job.attempts >= job.max_attempts
+        # A reclaimed job belongs to its new run, so a late failure leaves it alone.
+        owned(job).update(
+            status=Job.FAILED if done else Job.QUEUED,
+            run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            last_error=traceback.format_exc(),
+            locked_by='',
+            locked_at=None,
+        )
+        return False
+    return True
+
+
+def pending():
+    ready = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now())
+    return ready.exists() or Job.objects.filter(status=Job.RUNNING).exists()
+
+
+def release(worker):
+    return Job.objects.filter(status=Job.RUNNING, locked_by=worker).update(
+        status=Job.QUEUED, locked_by='', locked_at=None,
+    )
+
+
+def release_stale():
+    # Jobs of a worker that died mid-run go back to the queue once their lock is older than the timeout.
+    expired = timezone.now() - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT_SECONDS)
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=expired).update(
+        status=Job.QUEUED, locked_by='', locked_at=None,
+    )
@@ -0,0 +1,28 @@
+import time
+from django.db.models.deletion import Collector
+
+
+def delete_in_chunks(queryset, chunk_size=1000, sleep=0, dry_run=False, progress=None):
+    deleted = 0
+    last = None
+    while True:
+        window = queryset if last is None else queryset.filter(pk__gt=last)
+        keys = list(window.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not keys:
+            break
+        chunk = queryset.filter(pk__gte=keys[0], pk__lte=keys[-1])
+        if dry_run:
+            count = len(keys)
+        elif Collector(using=chunk.db).can_fast_delete(chunk):
+            count = chunk._raw_delete(chunk.db)
+        else:
+            count = chunk.delete()[0]
+        deleted += count
+        last = keys[-1]
+        if progress:
+            progress(deleted, last)
+        if len(keys) < chunk_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return deleted
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from mainapp.bench import API_ROOT, summarize
+
+
+class Command(BaseCommand):
+    help = "Send the same concurrent load to a sync and an async endpoint and compare throughput and latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--sync-path', default=f'{API_ROOT}/products/')
+        parser.add_argument('--async-path', default='/async/products/')
+
+    async def run(self, path, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        # Both endpoints serve the catalog cache, so each is warmed before it is timed.
+        await client.get(path)
+        started = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(total)])
+        result = summarize(latencies, time.perf_counter() - started)
+        result['errors'] = errors
+        return result
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for label in ('sync', 'async'):
+                path = options[f'{label}_path']
+                result = asyncio.run(self.run(path, options['requests'], options['concurrency']))
+                self.stdout.write(
+                    f'{label} {path}: {result["rps"]} req/s, p50 {result["p50_ms"]}ms, '
+                    f'p99 {result["p99_ms"]}ms, errors: {result["errors"]}'
+                )
@@ -0,0 +1,102 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from mainapp import stock as stock_counters
+from mainapp.models import Product, Purchase, PurchaseLine, StockShard
+from mainapp.services import purchase_product, NotEnoughProducts
+from accountsapp.models import Client
+from mainapp.bench import last_job_id, delete_jobs
+
+
+def parse_shards(value):
+    try:
+        shards = [int(part) for part in value.split(',')]
+    except ValueError:
+        raise CommandError(f'Bad shard list: {value}')
+    if any(count < 0 for count in shards):
+        raise CommandError(f'Bad shard list: {value}')
+    return shards
+
+
+class Command(BaseCommand):
+    help = "Buy one product from many threads at once and check that it is never oversold."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--attempts', type=int, default=50, help='Purchases tried by every thread.')
+        parser.add_argument('--stock', type=int, default=500)
+        parser.add_argument('--count', type=int, default=1, help='Units bought per purchase.')
+        parser.add_argument(
+            '--shards', type=parse_shards, default=[0],
+            help='Comma separated stock shard counts, one round each (0 keeps the stock on the product row).',
+        )
+
+    def handle(self, *args, **options):
+        results = [(shards, self.round(options, shards)) for shards in options['shards']]
+        if len(results) > 1:
+            baseline = results[0][1] or 1e-9
+            for shards, rate in results:
+                self.stdout.write(f'shards: {shards}, {rate:.1f} purchases/s, x{rate / baseline:.2f}')
+
+    def round(self, options, shards):
+        threads = options['threads']
+        stock = options['stock']
+        prefix = f'bench_{uuid.uuid4().hex[:8]}'
+        since_job_id = last_job_id()
+        product = Product.objects.create(name=prefix, price=1, count_in_storage=stock)
+        if shards:
+            stock_counters.set_shards(product.pk, shards)
+        clients = [
+            Client.objects.create(user=User.objects.create_user(f'{prefix}_{i}'), wallet=10 ** 9)
+            for i in range(threads)
+        ]
+
+        def worker(client):
+            stats = {'bought': 0, 'sold_out': 0, 'errors': 0}
+            try:
+                for _ in range(options['attempts']):
+                    try:
+                        purchase_product(client, product.pk, options['count'])
+                        stats['bought'] += 1
+                    except NotEnoughProducts:
+                        stats['sold_out'] += 1
+                    except OperationalError:
+                        stats['errors'] += 1
+            finally:
+                connection.close()
+            return stats
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(worker, clients))
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(result[key] for result in results) for key in results[0]}
+        attempts = threads * options['attempts']
+        if shards:
+            left = StockShard.objects.filter(product=product).aggregate(units=Sum('count'))['units'] or 0
+        else:
+            product.refresh_from_db()
+            left = product.count_in_storage
+        sold = PurchaseLine.objects.filter(product=product).aggregate(units=Sum('qty'))['units'] or 0
+        oversold = sold > stock or left != stock - sold or left < 0
+
+        self.stdout.write(f'shards: {shards}, threads: {threads}, attempts: {attempts}, time: {elapsed:.2f}s')
+        self.stdout.write(f'throughput: {attempts / elapsed:.1f} attempts/s, {totals["bought"] / elapsed:.1f} purchases/s')
+        self.stdout.write(f'bought: {totals["bought"]}, sold out: {totals["sold_out"]}, db errors: {totals["errors"]}')
+        self.stdout.write(f'units sold: {sold} of {stock}, left in storage: {left}')
+
+        Purchase.objects.filter(user__in=clients).delete()
+        delete_jobs(since_job_id, [product.pk])
+        product.delete()
+        User.objects.filter(username__startswith=prefix).delete()
+
+        if oversold:
+            self.stderr.write(self.style.ERROR('OVERSOLD'))
+        else:
+            self.stdout.write(self.style.SUCCESS('no oversell'))
+        return totals['bought'] / elapsed
@@ -0,0 +1,31 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from mainapp.management.chunking import delete_in_chunks
+
+
+class Command(BaseCommand):
+    help = "Delete expired API tokens in small chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to wait between chunks.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the tokens that would be deleted.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=settings.TOKEN_EXPIRE_MINUTES)
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+
+        def progress(deleted, last):
+            self.stdout.write(f'{deleted} tokens {verb}, up to key {last[:8]}...')
+
+        deleted = delete_in_chunks(
+            Token.objects.filter(created__lt=cutoff),
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        self.stdout.write(f'expired tokens {verb}: {deleted}')
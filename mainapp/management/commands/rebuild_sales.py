@@ -0,0 +1,47 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from mainapp.models import Purchase, ReturnedLine
+from mainapp import sales
+
+
+def parse_day(value):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError(f'Invalid date: {value}')
+    return day
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales table from purchase and returned lines, one window of days at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_day, metavar='DATE', help='Default: the day of the first purchase.')
+        parser.add_argument('--until', type=parse_day, metavar='DATE', help='Default: today.')
+        parser.add_argument('--days-per-batch', type=int, default=31)
+
+    def handle(self, *args, **options):
+        until = options['until'] or timezone.localdate()
+        since = options['since']
+        if since is None:
+            firsts = [
+                Purchase.objects.aggregate(first=Min('create_at'))['first'],
+                ReturnedLine.objects.aggregate(first=Min('purchased_at'))['first'],
+            ]
+            first = min([moment for moment in firsts if moment], default=None)
+            since = timezone.localdate(first) if first else until
+        step = timedelta(days=max(options['days_per_batch'], 1))
+
+        start = since
+        total = 0
+        while start <= until:
+            end = min(start + step - timedelta(days=1), until)
+            with transaction.atomic():
+                rows = sales.rebuild(start, end)
+            total += rows
+            self.stdout.write(f'{start} - {end}: {rows} rows')
+            start = end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'daily sales rebuilt: {total} rows'))
@@ -1,11 +1,83 @@
-from django.core.management.base import BaseCommand
+import time
+from datetime import datetime, timedelta
+from itertools import count
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 from mainapp.models import Return
+from mainapp.management.chunking import delete_in_chunks
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        moment = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
 
 
 class Command(BaseCommand):
-    help = "All return requests must be refused."
+    help = "Refuse return requests, all of them or only those matching the filters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='MINUTES', help='Only returns requested more than MINUTES ago.')
+        parser.add_argument('--user', help='Only returns of this username.')
+        parser.add_argument('--purchased-before', type=parse_moment, metavar='DATE')
+        parser.add_argument('--purchased-after', type=parse_moment, metavar='DATE')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to wait between chunks.')
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument(
+            '--daemon', action='store_true',
+            help='Keep running and refuse returns older than --older-than (default RETURN_REVIEW_MINUTES) every --interval seconds.',
+        )
+        parser.add_argument('--interval', type=float, default=60)
+        parser.add_argument('--runs', type=int, default=0, help='Stop the daemon after this many runs (0 means never).')
 
     def handle(self, *args, **options):
-        if Return.objects.exists(): 
-            Return.objects.all().delete()
-        print('returns are clear')
\ No newline at end of file
+        if options['daemon'] and options['older_than'] is None:
+            options['older_than'] = settings.RETURN_REVIEW_MINUTES
+        if not options['daemon']:
+            self.reject(options)
+            return
+
+        try:
+            for run in count(1):
+                self.reject(options)
+                if run == options['runs']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def get_queryset(self, options):
+        queryset = Return.objects.all()
+        if options['older_than'] is not None:
+            queryset = queryset.filter(create_at__lt=timezone.now() - timedelta(minutes=options['older_than']))
+        if options['user']:
+            queryset = queryset.filter(purchase__user__user__username=options['user'])
+        if options['purchased_before']:
+            queryset = queryset.filter(purchase__create_at__lt=options['purchased_before'])
+        if options['purchased_after']:
+            queryset = queryset.filter(purchase__create_at__gte=options['purchased_after'])
+        return queryset
+
+    def reject(self, options):
+        verb = 'would be refused' if options['dry_run'] else 'refused'
+
+        def progress(deleted, last):
+            self.stdout.write(f'{deleted} returns {verb}, up to id {last}')
+
+        deleted = delete_in_chunks(
+            self.get_queryset(options),
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        self.stdout.write(f'returns {verb}: {deleted}')
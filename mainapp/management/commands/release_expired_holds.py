@@ -0,0 +1,32 @@
+import time
+from itertools import count
+from django.core.management.base import BaseCommand
+from mainapp.services import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Return the stock of expired holds to the shelf."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--daemon', action='store_true', help='Keep sweeping every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=30)
+        parser.add_argument('--runs', type=int, default=0, help='Stop the daemon after this many runs (0 means never).')
+
+    def handle(self, *args, **options):
+        if not options['daemon']:
+            self.sweep(options)
+            return
+
+        try:
+            for run in count(1):
+                self.sweep(options)
+                if run == options['runs']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def sweep(self, options):
+        released = release_expired_holds(chunk_size=options['chunk_size'])
+        self.stdout.write(f'holds released: {released}')
@@ -0,0 +1,65 @@
+import os
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from mainapp import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs from worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed by a thread at once.')
+        parser.add_argument('--poll', type=float, default=1, help='Seconds an idle thread waits before looking again.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is ready or running instead of polling.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        totals = {'done': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def step(worker):
+            claimed = jobs.claim(worker, options['batch_size'])
+            for job in claimed:
+                result = 'done' if jobs.run(job) else 'failed'
+                with lock:
+                    totals[result] += 1
+            return len(claimed) or jobs.release_stale()
+
+        def work(number):
+            worker = f'{socket.gethostname()}:{os.getpid()}:{number}'
+            try:
+                while not stop.is_set():
+                    try:
+                        if step(worker):
+                            continue
+                        if options['once'] and not jobs.pending():
+                            break
+                    except DatabaseError as error:
+                        self.stderr.write(f'{worker}: {error}')
+                        # Jobs this worker still holds go back to the queue before it carries on.
+                        while not stop.wait(options['poll']):
+                            try:
+                                jobs.release(worker)
+                                break
+                            except DatabaseError:
+                                pass
+                        continue
+                    stop.wait(options['poll'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(number,)) for number in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(f'jobs done: {totals["done"]}, failed attempts: {totals["failed"]}')
@@ -0,0 +1,184 @@
+import csv
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from mainapp import catalog_cache
+from mainapp.models import Product, Purchase, PurchaseLine
+from accountsapp.models import Client, WalletEntry
+
+
+ADJECTIVES = ['Fresh', 'Organic', 'Classic', 'Light', 'Strong', 'Sweet', 'Green', 'Dark', 'Sparkling', 'Premium']
+NOUNS = ['Water', 'Coffee', 'Tea', 'Juice', 'Protein bar', 'Shake', 'Granola', 'Cereal', 'Chocolate', 'Smoothie']
+USES = ['light-training', 'recovery', 'breakfast', 'long runs', 'the office', 'kids', 'cold days', 'the gym']
+SUFFIXES = {'k': 10 ** 3, 'm': 10 ** 6}
+
+
+def parse_count(value):
+    value = value.strip().lower()
+    multiplier = SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        count = int(float(number) * multiplier)
+    except ValueError:
+        raise CommandError(f'Bad count: {value}')
+    if count < 0:
+        raise CommandError(f'Bad count: {value}')
+    return count
+
+
+def skewed(rng, size):
+    # Most picks are uniform, the rest land on a small head so some clients and products are much busier.
+    if rng.random() < 0.8:
+        return rng.randrange(size)
+    return min(int(rng.paretovariate(1.2)) - 1, size - 1)
+
+
+class Table:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = [model._meta.get_field(name) for name in fields]
+
+    def prepare(self, rows):
+        return [
+            [field.get_db_prep_save(value, connection) for field, value in zip(self.fields, row)]
+            for row in rows
+        ]
+
+    def write(self, rows):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in self.fields)
+        rows = self.prepare(rows)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(['\\N' if value is None else value for value in row] for row in rows)
+                buffer.seek(0)
+                sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                if hasattr(cursor, 'copy_expert'):
+                    cursor.copy_expert(sql, buffer)
+                else:
+                    with cursor.copy(sql) as copy:
+                        copy.write(buffer.getvalue())
+            else:
+                placeholders = ', '.join(['%s'] * len(self.fields))
+                cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+
+
+class Command(BaseCommand):
+    help = "Generate a large deterministic shop dataset in streaming batches (1k/1M suffixes are accepted)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=parse_count, default=1000)
+        parser.add_argument('--clients', type=parse_count, default=100)
+        parser.add_argument('--purchases', type=parse_count, default=10000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=4, help='Ignored on SQLite, which allows one writer.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--days', type=int, default=365, help='Purchases are spread over this many days.')
+
+    def handle(self, *args, **options):
+        if options['purchases'] and not (options['products'] and options['clients']):
+            raise CommandError('Purchases need at least one seeded product and client')
+        self.options = options
+        self.now = timezone.now()
+        self.workers = 1 if connection.vendor == 'sqlite' else max(options['workers'], 1)
+        through = Purchase.product.through
+        self.base = {
+            model: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            for model in (Product, User, Client, WalletEntry, Purchase, through, PurchaseLine)
+        }
+
+        self.seed_table('products', options['products'], self.product_rows)
+        self.seed_table('users', options['clients'], self.user_rows)
+        self.seed_table('clients', options['clients'], self.client_rows)
+        self.seed_table('purchases', options['purchases'], self.purchase_rows)
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(self.base)):
+                cursor.execute(sql)
+        catalog_cache.invalidate()
+
+    def seed_table(self, name, total, write_batch):
+        if not total:
+            return
+        size = self.options['batch_size']
+
+        def run(batch):
+            try:
+                start = batch * size
+                write_batch(random.Random(f'{self.options["seed"]}:{name}:{batch}'), start, min(size, total - start))
+            finally:
+                if self.workers > 1:
+                    connection.close()
+
+        started = time.perf_counter()
+        batches = range((total + size - 1) // size)
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(run, batches))
+        else:
+            for batch in batches:
+                run(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)')
+
+    def product_rows(self, rng, start, count):
+        base = self.base[Product]
+        rows = []
+        for i in range(start, start + count):
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i + 1}'
+            text = f'{name} for {rng.choice(USES)}'
+            price = Decimal(min(rng.lognormvariate(3, 1), 10 ** 6)).quantize(Decimal('0.01'))
+            stock = 0 if rng.random() < 0.05 else rng.randint(1, 500)
+            rows.append((base + i, name, text, price, stock, 0, self.now))
+        Table(Product, ['id', 'name', 'text', 'price', 'count_in_storage', 'stock_shards', 'updated_at']).write(rows)
+
+    def user_rows(self, rng, start, count):
+        base = self.base[User]
+        rows = []
+        for i in range(start, start + count):
+            joined = self.now - timedelta(seconds=rng.randrange(self.options['days'] * 86400 + 1))
+            rows.append((base + i, '!', False, f'seed_{self.options["seed"]}_{base + i}', '', '', '', False, True, joined))
+        Table(User, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined',
+        ]).write(rows)
+
+    def client_rows(self, rng, start, count):
+        clients, entries = [], []
+        for i in range(start, start + count):
+            wallet = Decimal(rng.randint(100, 100000))
+            clients.append((self.base[Client] + i, self.base[User] + i, wallet))
+            entries.append((self.base[WalletEntry] + i, self.base[Client] + i, wallet, WalletEntry.OPENING, self.now))
+        Table(Client, ['id', 'user', 'wallet']).write(clients)
+        Table(WalletEntry, ['id', 'client', 'amount', 'kind', 'create_at']).write(entries)
+
+    def purchase_rows(self, rng, start, count):
+        purchases, links, lines = [], [], []
+        picks = [
+            (self.base[Client] + skewed(rng, self.options['clients']), self.base[Product] + skewed(rng, self.options['products']))
+            for _ in range(count)
+        ]
+        products = dict(
+            (pk, (name, price))
+            for pk, name, price in Product.objects.filter(pk__in={product for _, product in picks}).values_list('pk', 'name', 'price')
+        )
+        for i, (client, product) in enumerate(picks, start):
+            created = self.now - timedelta(seconds=rng.randrange(self.options['days'] * 86400 + 1))
+            qty = rng.randint(1, 5)
+            name, price = products[product]
+            purchases.append((self.base[Purchase] + i, client, created, qty, created))
+            links.append((self.base[Purchase.product.through] + i, self.base[Purchase] + i, product))
+            lines.append((self.base[PurchaseLine] + i, self.base[Purchase] + i, product, qty, price, name))
+        Table(Purchase, ['id', 'user', 'create_at', 'count', 'updated_at']).write(purchases)
+        Table(Purchase.product.through, ['id', 'purchase', 'product']).write(links)
+        Table(PurchaseLine, ['id', 'purchase', 'product', 'qty', 'unit_price', 'product_name']).write(lines)
@@ -0,0 +1,49 @@
+import time
+from itertools import count
+from django.core.management.base import BaseCommand, CommandError
+from mainapp import stock
+from mainapp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Split the stock of hot products over several counter rows, and spread sharded stock evenly again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('products', nargs='*', type=int, help='Product ids; all sharded products when omitted.')
+        parser.add_argument('--shards', type=int, help='Split the given products into this many shards (0 merges them back).')
+        parser.add_argument('--daemon', action='store_true', help='Keep rebalancing every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60)
+        parser.add_argument('--runs', type=int, default=0, help='Stop the daemon after this many runs (0 means never).')
+
+    def handle(self, *args, **options):
+        if options['shards'] is not None:
+            self.set_shards(options)
+            return
+        if not options['daemon']:
+            self.rebalance(options)
+            return
+
+        try:
+            for run in count(1):
+                self.rebalance(options)
+                if run == options['runs']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def set_shards(self, options):
+        if not options['products']:
+            raise CommandError('--shards needs at least one product id')
+        if options['shards'] < 0:
+            raise CommandError('--shards must not be negative')
+        for product_id in options['products']:
+            try:
+                units = stock.set_shards(product_id, options['shards'])
+            except Product.DoesNotExist:
+                raise CommandError(f'Product {product_id} does not exist')
+            self.stdout.write(f'product {product_id}: {units} units in {options["shards"]} shards')
+
+    def rebalance(self, options):
+        rebalanced = stock.rebalance(options['products'])
+        self.stdout.write(f'products rebalanced: {rebalanced}')
@@ -0,0 +1,175 @@
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as HttpClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from mainapp.bench import API_ROOT, summarize, last_job_id, delete_jobs
+from mainapp.models import Product, Purchase, Return
+from accountsapp.models import Client
+from accountsapp.tokens import issue_signed_token
+
+
+DEFAULT_MIX = 'browse=70,buy=20,return=7,confirm=3'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('browse', 'buy', 'return', 'confirm') or not weight.isdigit():
+            raise CommandError(f'Bad --mix entry: {part}')
+        mix[name] = int(weight)
+    return mix
+
+
+class Worker:
+    def __init__(self, client, products, admin_token, rng):
+        self.client = client
+        self.products = products
+        self.admin_header = {'HTTP_AUTHORIZATION': f'Signed {admin_token}'}
+        self.rng = rng
+        self.http = HttpClient(raise_request_exception=False)
+        self.http.force_login(client.user)
+        self.purchases = []
+        self.returns = []
+        self.stats = defaultdict(lambda: {'latencies': [], 'queries': 0, 'errors': 0})
+
+    def request(self, name, method, path, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.http, method)(path, **kwargs)
+            elapsed = time.perf_counter() - started
+        stats = self.stats[name]
+        stats['latencies'].append(elapsed)
+        stats['queries'] += len(queries)
+        if response.status_code >= 400:
+            stats['errors'] += 1
+        return response
+
+    def browse(self):
+        self.request('browse.products', 'get', '/products/')
+        self.request('browse.api', 'get', f'{API_ROOT}/products/', data={'page_size': 20})
+        self.request('browse.detail', 'get', f'/product/{self.rng.choice(self.products)}/')
+
+    def buy(self):
+        self.request('buy', 'post', '/purchases/', data={'pk': self.rng.choice(self.products), 'count': 1})
+        purchase = Purchase.objects.filter(user=self.client).exclude(pk__in=self.purchases).order_by('-pk').first()
+        if purchase:
+            self.purchases.append(purchase.pk)
+
+    def make_return(self):
+        if not self.purchases:
+            return self.buy()
+        purchase_id = self.purchases.pop()
+        self.request('return', 'post', '/returns/', data={'purchase_id': purchase_id})
+        self.returns += Return.objects.filter(purchase_id=purchase_id).values_list('pk', flat=True)
+
+    def confirm(self):
+        if not self.returns:
+            return self.make_return()
+        ids, self.returns = self.returns, []
+        self.request(
+            'confirm', 'post', f'{API_ROOT}/returns/confirm/', data={'ids': ids},
+            content_type='application/json', **self.admin_header,
+        )
+
+    def run(self, operations, mix):
+        actions = {'browse': self.browse, 'buy': self.buy, 'return': self.make_return, 'confirm': self.confirm}
+        names = list(mix)
+        try:
+            for _ in range(operations):
+                actions[self.rng.choices(names, weights=[mix[name] for name in names])[0]]()
+        finally:
+            connection.close()
+        return self.stats
+
+
+class Command(BaseCommand):
+    help = "Replay a mixed browse/buy/return/confirm workload over HTTP and report latency and queries per request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=100, help='Operations run by every thread.')
+        parser.add_argument('--products', type=int, default=200, help='Products seeded for the run.')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of browse, buy, return and confirm.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', default='', help='Stored in the report, e.g. a commit hash.')
+        parser.add_argument('--output', help='Write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        threads = options['threads']
+        prefix = f'shopbench_{uuid.uuid4().hex[:8]}'
+        since_job_id = last_job_id()
+        products = [
+            product.pk for product in Product.objects.bulk_create([
+                Product(name=f'{prefix}_{i}', text='Benchmark product', price=1 + i % 100, count_in_storage=10 ** 6)
+                for i in range(options['products'])
+            ])
+        ]
+        clients = [
+            Client.objects.create(user=User.objects.create_user(f'{prefix}_{i}'), wallet=10 ** 9)
+            for i in range(threads)
+        ]
+        admin = User.objects.create_superuser(f'{prefix}_admin')
+
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                workers = [
+                    Worker(client, products, issue_signed_token(admin), random.Random(options['seed'] + i))
+                    for i, client in enumerate(clients)
+                ]
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    results = list(pool.map(lambda worker: worker.run(options['operations'], mix), workers))
+                elapsed = time.perf_counter() - started
+        finally:
+            Purchase.objects.filter(user__in=clients).delete()
+            Product.objects.filter(name__startswith=prefix).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            delete_jobs(since_job_id, products)
+
+        merged = defaultdict(lambda: {'latencies': [], 'queries': 0, 'errors': 0})
+        for stats in results:
+            for name, values in stats.items():
+                merged[name]['latencies'] += values['latencies']
+                merged[name]['queries'] += values['queries']
+                merged[name]['errors'] += values['errors']
+        merged['total'] = {
+            'latencies': [latency for values in merged.values() for latency in values['latencies']],
+            'queries': sum(values['queries'] for values in merged.values()),
+            'errors': sum(values['errors'] for values in merged.values()),
+        }
+
+        report = {
+            'label': options['label'],
+            'created': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'threads': threads,
+            'operations': options['operations'],
+            'mix': mix,
+            'seed': options['seed'],
+            'requests': {},
+        }
+        for name, values in sorted(merged.items()):
+            result = summarize(values['latencies'], elapsed)
+            result['errors'] = values['errors']
+            result['queries_per_request'] = round(values['queries'] / max(len(values['latencies']), 1), 2)
+            report['requests'][name] = result
+            self.stdout.write(
+                f'{name}: {result["requests"]} requests, {result["rps"]} req/s, p50 {result["p50_ms"]}ms, '
+                f'p95 {result["p95_ms"]}ms, p99 {result["p99_ms"]}ms, '
+                f'{result["queries_per_request"]} queries/request, errors: {result["errors"]}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'report written to {options["output"]}'))
@@ -0,0 +1,112 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('mainapp.requests')
+
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    return LITERALS.sub('?', IN_LIST.sub('(...)', sql))
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started, context['connection'].alias))
+
+
+def watch_queries(stack, recorder):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+
+
+class QueryTraceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.QUERY_TRACE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            watch_queries(stack, recorder)
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.QUERY_TRACE_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        # Connections belong to the thread that sync_to_async runs the request's queries in,
+        # so the wrappers are installed and removed there.
+        recorder = QueryRecorder()
+        stack = ExitStack()
+        started = time.perf_counter()
+        await sync_to_async(watch_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    def finish(self, request, response, recorder, elapsed):
+        db_time = sum(duration for _, duration, _ in recorder.queries)
+        response['Server-Timing'] = (
+            f'db;dur={db_time * 1000:.1f};desc="{len(recorder.queries)} queries", '
+            f'app;dur={elapsed * 1000:.1f};desc="request"'
+        )
+        self.log(request, response, recorder.queries, db_time, elapsed)
+        return response
+
+    def log(self, request, response, queries, db_time, elapsed):
+        slowest = sorted(queries, key=lambda query: query[1], reverse=True)[:settings.QUERY_TRACE_TOP_QUERIES]
+        repeated = Counter(fingerprint(sql) for sql, _, _ in queries).most_common()
+        duplicates = [
+            {'sql': sql, 'count': count}
+            for sql, count in repeated if count >= settings.QUERY_TRACE_DUPLICATE_THRESHOLD
+        ]
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'request_ms': round(elapsed * 1000, 1),
+            'db_ms': round(db_time * 1000, 1),
+            'queries': len(queries),
+            'slowest': [
+                {'sql': sql, 'ms': round(duration * 1000, 1), 'db': alias} for sql, duration, alias in slowest
+            ],
+            'duplicates': duplicates,
+        }
+        slow = (
+            elapsed * 1000 >= settings.QUERY_TRACE_SLOW_REQUEST_MS
+            or any(duration * 1000 >= settings.QUERY_TRACE_SLOW_QUERY_MS for _, duration, _ in slowest)
+        )
+        logger.log(logging.WARNING if slow or duplicates else logging.INFO, json.dumps(record))
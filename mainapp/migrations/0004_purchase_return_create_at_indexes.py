@@ -0,0 +1,26 @@
+# Generated by Django 4.2.8 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_auto_20231222_1634'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['create_at', 'id'], name='mainapp_pur_create__9fb9f9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='return',
+            index=models.Index(fields=['create_at', 'id'], name='mainapp_ret_create__208c2c_idx'),
+        ),
+    ]
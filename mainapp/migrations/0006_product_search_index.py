@@ -0,0 +1,63 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+# The DDL is kept here rather than imported, so the migration does not change with mainapp.search.
+STATEMENTS = {
+    'postgresql': (
+        [
+            "ALTER TABLE mainapp_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(text, '')), 'B')) STORED",
+            "CREATE INDEX mainapp_product_search_idx ON mainapp_product USING gin (search_vector)",
+        ],
+        [
+            "DROP INDEX IF EXISTS mainapp_product_search_idx",
+            "ALTER TABLE mainapp_product DROP COLUMN IF EXISTS search_vector",
+        ],
+    ),
+    'sqlite': (
+        [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_product_fts USING fts5("
+            "name, text, content='mainapp_product', content_rowid='id')",
+            "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_insert AFTER INSERT ON mainapp_product BEGIN "
+            "INSERT INTO mainapp_product_fts(rowid, name, text) VALUES (new.id, new.name, new.text); END",
+            "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_delete AFTER DELETE ON mainapp_product BEGIN "
+            "INSERT INTO mainapp_product_fts(mainapp_product_fts, rowid, name, text) "
+            "VALUES ('delete', old.id, old.name, old.text); END",
+            "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_update AFTER UPDATE OF name, text ON mainapp_product BEGIN "
+            "INSERT INTO mainapp_product_fts(mainapp_product_fts, rowid, name, text) "
+            "VALUES ('delete', old.id, old.name, old.text); "
+            "INSERT INTO mainapp_product_fts(rowid, name, text) VALUES (new.id, new.name, new.text); END",
+            "INSERT INTO mainapp_product_fts(mainapp_product_fts) VALUES ('rebuild')",
+        ],
+        [
+            "DROP TRIGGER IF EXISTS mainapp_product_fts_insert",
+            "DROP TRIGGER IF EXISTS mainapp_product_fts_delete",
+            "DROP TRIGGER IF EXISTS mainapp_product_fts_update",
+            "DROP TABLE IF EXISTS mainapp_product_fts",
+        ],
+    ),
+}
+
+
+def install_search_index(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ((), ()))[0]:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ((), ()))[1]:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_product_purchase_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, drop_search_index),
+    ]
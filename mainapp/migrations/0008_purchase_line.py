@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-18 19:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0007_product_price_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qty', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('product_name', models.CharField(max_length=255)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_lines', to='mainapp.product')),
+                ('purchase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='mainapp.purchase')),
+            ],
+        ),
+    ]
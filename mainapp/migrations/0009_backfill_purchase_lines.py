@@ -0,0 +1,40 @@
+# Generated by Django 4.2.8 on 2026-10-18 19:40
+
+from django.db import migrations, transaction
+from django.db.models import Max
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_purchase_lines(apps, schema_editor):
+    # Each batch commits on its own, so the table is never locked for the whole run and an
+    # interrupted backfill can be started again; purchases made meanwhile already have lines.
+    Purchase = apps.get_model('mainapp', 'Purchase')
+    PurchaseLine = apps.get_model('mainapp', 'PurchaseLine')
+    through = Purchase.product.through
+    last_id = Purchase.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        batch = {'purchase_id__gte': start, 'purchase_id__lt': start + BATCH_SIZE}
+        with transaction.atomic():
+            existing = set(PurchaseLine.objects.filter(**batch).values_list('purchase_id', 'product_id'))
+            links = through.objects.filter(**batch).values_list(
+                'purchase_id', 'product_id', 'purchase__count', 'product__name', 'product__price'
+            )
+            PurchaseLine.objects.bulk_create([
+                PurchaseLine(purchase_id=purchase_id, product_id=product_id, qty=count or 0, unit_price=price, product_name=name)
+                for purchase_id, product_id, count, name, price in links
+                if (purchase_id, product_id) not in existing
+            ])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('mainapp', '0008_purchase_line'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_purchase_lines, migrations.RunPython.noop),
+    ]
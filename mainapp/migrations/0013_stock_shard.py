@@ -0,0 +1,57 @@
+# Generated by Django 4.2.8 on 2026-10-18 19:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# SQLite drops the search triggers when the product table is rebuilt for the new column; the DDL
+# is kept here rather than imported, so the migration does not change with mainapp.search.
+SQLITE_SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_product_fts USING fts5("
+    "name, text, content='mainapp_product', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_insert AFTER INSERT ON mainapp_product BEGIN "
+    "INSERT INTO mainapp_product_fts(rowid, name, text) VALUES (new.id, new.name, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_delete AFTER DELETE ON mainapp_product BEGIN "
+    "INSERT INTO mainapp_product_fts(mainapp_product_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS mainapp_product_fts_update AFTER UPDATE OF name, text ON mainapp_product BEGIN "
+    "INSERT INTO mainapp_product_fts(mainapp_product_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); "
+    "INSERT INTO mainapp_product_fts(rowid, name, text) VALUES (new.id, new.name, new.text); END",
+    "INSERT INTO mainapp_product_fts(mainapp_product_fts) VALUES ('rebuild')",
+]
+
+
+def restore_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_SEARCH_INDEX:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0012_stock_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='mainapp.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stockshard',
+            constraint=models.UniqueConstraint(fields=('product', 'index'), name='stock_shard_unique'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-18 20:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_stock_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReturnedLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qty', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('purchased_at', models.DateTimeField(db_index=True)),
+                ('returned_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='returned_lines', to='mainapp.product')),
+            ],
+        ),
+    ]
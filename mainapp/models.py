@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from accountsapp.models import Client
 
 
@@ -7,6 +8,15 @@ class Product(models.Model):
     text = models.TextField(null=True, blank=True)
     price = models.DecimalField(decimal_places=2, max_digits=12, null=True, blank=True)
     count_in_storage = models.IntegerField(null=True, blank=True)
+    # With shards the stock lives in StockShard rows and count_in_storage is the total as of the last rebalance.
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(count_in_storage__gt=0), name='product_in_stock_price_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -17,16 +27,115 @@ class Purchase(models.Model):
     create_at = models.DateTimeField(auto_now_add=True)
     product = models.ManyToManyField(Product)
     count = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['create_at', 'id'])]
 
     def __str__(self) -> str:
-        product_names = ', '.join([product.name for product in self.product.all()])
+        product_names = ', '.join([line.product_name for line in self.lines.all()])
         return f"{self.user} - {product_names}"
 
 
+class PurchaseLine(models.Model):
+    purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='purchase_lines')
+    qty = models.PositiveIntegerField()
+    unit_price = models.DecimalField(decimal_places=2, max_digits=12, null=True, blank=True)
+    product_name = models.CharField(max_length=255)
+
+    def __str__(self) -> str:
+        return f"{self.product_name} x {self.qty}"
+
+
+class ReturnedLine(models.Model):
+    # Confirmed returns delete their purchases; these rows keep what the daily sales rebuild needs.
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='returned_lines')
+    qty = models.PositiveIntegerField()
+    unit_price = models.DecimalField(decimal_places=2, max_digits=12, null=True, blank=True)
+    purchased_at = models.DateTimeField(db_index=True)
+    returned_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.product_id} x {self.qty} returned {self.returned_at}"
+
+
+class StockHold(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='stock_holds')
+    qty = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    create_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.client} holds {self.qty} x {self.product_id} until {self.expires_at}"
+
+
+class StockShard(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['product', 'index'], name='stock_shard_unique')]
+
+    def __str__(self) -> str:
+        return f"{self.product_id} shard {self.index}: {self.count}"
+
+
+class SalesDaily(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    returned_units = models.IntegerField(default=0)
+    refunded = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'product'], name='sales_daily_day_product')]
+
+    def __str__(self) -> str:
+        return f"{self.product_id} {self.day}: {self.units}"
+
+
 class Return(models.Model):
     purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, null = True, blank = True)
     create_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['create_at', 'id'])]
+
     def __str__(self) -> str:
         return f"{self.purchase.user} - {self.create_at}"
 
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    create_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', '-priority', 'run_at', 'id'], name='job_claim_idx')]
+
+    def __str__(self) -> str:
+        return f"{self.name} #{self.pk} ({self.status})"
+
@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.request import Request
+
+
+class ShopCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CreatedCursorPagination(ShopCursorPagination):
+    ordering = ('-create_at', '-id')
+
+
+class CursorPaginationMixin:
+    pagination_class = ShopCursorPagination
+
+    def paginate_object_list(self, object_list):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(object_list, Request(self.request))
+        return page, paginator.get_next_link(), paginator.get_previous_link()
+
+    def get_context_data(self, **kwargs):
+        page, next_link, previous_link = self.paginate_object_list(self.object_list)
+        kwargs.update(object_list=page, next_link=next_link, previous_link=previous_link)
+        return super().get_context_data(**kwargs)
@@ -2,7 +2,7 @@ from rest_framework.permissions import BasePermission
 
 class ProductPermission(BasePermission):
     def has_permission(self, request, view):
-        if view.action == 'create':
+        if view.action in ['create', 'cache_stats']:
             return request.user.is_authenticated and request.user.is_superuser
         return True
     
@@ -11,4 +11,9 @@ class ProductPermission(BasePermission):
             return request.user.is_authenticated
         elif view.action in ['update', 'partial_update', 'destroy']:
             return request.user.is_authenticated and request.user.is_superuser
-        return False
\ No newline at end of file
+        return False
+
+
+class IsSuperUser(BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_superuser
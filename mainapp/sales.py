@@ -0,0 +1,85 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import F, Case, When, Value, Sum, DecimalField
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Product, PurchaseLine, ReturnedLine, SalesDaily
+
+
+MONEY = DecimalField(decimal_places=2, max_digits=14)
+COUNTERS = {
+    'sold': ('units', 'revenue'),
+    'returned': ('returned_units', 'refunded'),
+}
+
+
+def add(lines, kind='sold', day=None):
+    # Adds the lines to their day's totals: missing rows are inserted empty, then one CASE update bumps them all.
+    units_field, money_field = COUNTERS[kind]
+    day = day or timezone.localdate()
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for line in lines:
+        if line.product_id:
+            totals[int(line.product_id)][0] += line.qty
+            totals[int(line.product_id)][1] += line.qty * (line.unit_price or 0)
+    # Queued lines can outlive their product; those are dropped so the rest of the cart is still booked.
+    existing = set(Product.objects.filter(pk__in=totals).values_list('pk', flat=True))
+    totals = {product_id: total for product_id, total in totals.items() if product_id in existing}
+    if not totals:
+        return
+    SalesDaily.objects.bulk_create(
+        [SalesDaily(product_id=product_id, day=day) for product_id in totals], ignore_conflicts=True
+    )
+    SalesDaily.objects.filter(day=day, product_id__in=totals).update(**{
+        units_field: F(units_field) + Case(
+            *[When(product_id=product_id, then=Value(units)) for product_id, (units, _) in totals.items()],
+            default=Value(0),
+        ),
+        money_field: F(money_field) + Case(
+            *[When(product_id=product_id, then=Value(money)) for product_id, (_, money) in totals.items()],
+            default=Value(Decimal(0)),
+            output_field=MONEY,
+        ),
+    })
+
+
+def rebuild(start, end):
+    # Same booking as add(): units sold count on the purchase day, returns on the day they were confirmed.
+    # Returned purchases are deleted, so their side of both comes from ReturnedLine.
+    SalesDaily.objects.filter(day__range=(start, end)).delete()
+    totals = defaultdict(lambda: [0, Decimal(0), 0, Decimal(0)])
+    sources = [
+        (PurchaseLine.objects.filter(product__isnull=False), 'purchase__create_at', 0),
+        (ReturnedLine.objects.filter(product__isnull=False), 'purchased_at', 0),
+        (ReturnedLine.objects.filter(product__isnull=False), 'returned_at', 2),
+    ]
+    for queryset, moment, offset in sources:
+        rows = (
+            queryset.annotate(day=TruncDate(moment))
+            .filter(day__range=(start, end))
+            .values('day', 'product_id')
+            .annotate(units=Sum('qty'), money=Sum(F('qty') * F('unit_price'), output_field=MONEY))
+            .order_by()
+        )
+        for row in rows.iterator():
+            counters = totals[row['day'], row['product_id']]
+            counters[offset] += row['units']
+            counters[offset + 1] += row['money'] or 0
+    return len(SalesDaily.objects.bulk_create([
+        SalesDaily(
+            product_id=product_id, day=day, units=units, revenue=revenue,
+            returned_units=returned_units, refunded=refunded,
+        )
+        for (day, product_id), (units, revenue, returned_units, refunded) in totals.items()
+    ], batch_size=1000))
+
+
+def top_products(start, end, limit=10, order='units'):
+    net_units = Sum('units') - Sum('returned_units')
+    net_revenue = Sum('revenue') - Sum('refunded')
+    return list(
+        SalesDaily.objects.filter(day__range=(start, end))
+        .values('product_id', 'product__name')
+        .annotate(units=net_units, revenue=net_revenue)
+        .order_by(f'-{order}', 'product_id')[:limit]
+    )
@@ -0,0 +1,60 @@
+from django.db import connection, NotSupportedError
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from .models import Product
+
+
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+POSTGRES_SEARCH = (
+    "SELECT {columns}, ts_rank(p.search_vector, q.query) AS rank, "
+    "ts_headline('english', p.name || '. ' || coalesce(p.text, ''), q.query, %s) AS headline "
+    "FROM mainapp_product p, websearch_to_tsquery('english', %s) AS q(query) "
+    "WHERE p.search_vector @@ q.query "
+    "ORDER BY rank DESC, p.id LIMIT %s OFFSET %s"
+)
+
+SQLITE_SEARCH = (
+    "SELECT {columns}, -bm25(mainapp_product_fts, 10.0, 1.0) AS rank, "
+    "snippet(mainapp_product_fts, -1, %s, %s, '...', 12) AS headline "
+    "FROM mainapp_product_fts JOIN mainapp_product p ON p.id = mainapp_product_fts.rowid "
+    "WHERE mainapp_product_fts MATCH %s "
+    "ORDER BY rank DESC, p.id LIMIT %s OFFSET %s"
+)
+
+
+def search_products(query, limit=20, offset=0):
+    terms = query.split()
+    if not terms:
+        return []
+    columns = ', '.join(f'p.{connection.ops.quote_name(field.column)}' for field in Product._meta.concrete_fields)
+    if connection.vendor == 'postgresql':
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2'
+        sql = POSTGRES_SEARCH.format(columns=columns)
+        params = [options, query, limit, offset]
+    elif connection.vendor == 'sqlite':
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        sql = SQLITE_SEARCH.format(columns=columns)
+        params = [HIGHLIGHT_START, HIGHLIGHT_STOP, match, limit, offset]
+    else:
+        raise NotSupportedError(f'Product search is not available on {connection.vendor}')
+
+    products = list(Product.objects.raw(sql, params))
+    for product in products:
+        product.headline = mark_safe(
+            escape(product.headline).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+        )
+    return products
+
+
+def search_page(request, q, offset=0, page_size=20):
+    products = search_products(q, page_size + 1, offset)
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, 'offset', offset + page_size) if len(products) > page_size else None
+    previous_link = None
+    if offset > 0:
+        previous_offset = max(offset - page_size, 0)
+        previous_link = replace_query_param(url, 'offset', previous_offset) if previous_offset else remove_query_param(url, 'offset')
+    return products[:page_size], next_link, previous_link
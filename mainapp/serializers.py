@@ -1,6 +1,11 @@
+from datetime import timedelta
+from django.db.models import Prefetch
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Product, Purchase, Return
+from .models import Product, Purchase, PurchaseLine, Return, StockHold
 from accountsapp.models import Client
+from accountsapp import wallet
+from . import stock
 from django.contrib.auth.models import User
 
 
@@ -11,24 +16,62 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'text', 'price', 'count_in_storage']
 
+    def update(self, instance, validated_data):
+        product = super().update(instance, validated_data)
+        if product.stock_shards and 'count_in_storage' in validated_data:
+            stock.set_stock(product.pk, validated_data['count_in_storage'] or 0)
+        return product
+
 
 class ClientSerializer(serializers.ModelSerializer):
     
     user = serializers.PrimaryKeyRelatedField(read_only = True)
+    wallet = serializers.DecimalField(source='balance', max_digits=12, decimal_places=2, required=False)
 
     class Meta:
         model = Client
         fields = ['user', 'wallet']
 
+    def create(self, validated_data):
+        if 'balance' in validated_data:
+            validated_data['wallet'] = validated_data.pop('balance')
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if 'balance' in validated_data:
+            instance.balance = wallet.set_balance(instance.pk, validated_data.pop('balance'))
+        return super().update(instance, validated_data)
+
+
+class PurchaseLineSerializer(serializers.ModelSerializer):
+
+    id = serializers.IntegerField(source='product_id', read_only=True)
+    name = serializers.CharField(source='product_name', read_only=True)
+    price = serializers.DecimalField(source='unit_price', decimal_places=2, max_digits=12, read_only=True)
+
+    class Meta:
+        model = PurchaseLine
+        fields = ['id', 'name', 'price', 'qty']
+
+
+def purchase_lines(path='lines'):
+    return Prefetch(path, queryset=PurchaseLine.objects.select_related('product'))
+
 
 class PurchaseSerializer(serializers.ModelSerializer):    
 
-    product = ProductSerializer(read_only = True, many=True)
+    product = serializers.SerializerMethodField()
+    lines = PurchaseLineSerializer(read_only = True, many=True)
     user = ClientSerializer(read_only = True)
     
     class Meta:
         model = Purchase
-        fields = ['id', 'user', 'product', 'count']
+        fields = ['id', 'user', 'product', 'count', 'lines']
+
+    def get_product(self, purchase):
+        # The products keep their original shape but are reached through the lines, see purchase_lines().
+        products = [line.product for line in purchase.lines.all() if line.product is not None]
+        return ProductSerializer(products, many=True).data
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -46,4 +89,62 @@ class ReturnSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Return
-        fields = ['id', 'purchase']
\ No newline at end of file
+        fields = ['id', 'purchase']
+
+
+class CheckoutItemSerializer(serializers.Serializer):
+
+    product = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1)
+
+
+class CheckoutSerializer(serializers.Serializer):
+
+    items = CheckoutItemSerializer(many=True, allow_empty=False)
+
+
+
+class SearchQuerySerializer(serializers.Serializer):
+
+    q = serializers.CharField()
+    offset = serializers.IntegerField(min_value=0, default=0)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+
+class ProductFilterSerializer(serializers.Serializer):
+
+    min_price = serializers.DecimalField(decimal_places=2, max_digits=12, required=False)
+    max_price = serializers.DecimalField(decimal_places=2, max_digits=12, required=False)
+    in_stock = serializers.BooleanField(required=False)
+
+
+
+class ReturnConfirmSerializer(serializers.Serializer):
+
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+
+class TopProductsQuerySerializer(serializers.Serializer):
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    order = serializers.ChoiceField(choices=['units', 'revenue'], default='units')
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=6))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start must not be after end')
+        return data
+
+
+class StockHoldSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = StockHold
+        fields = ['id', 'product', 'qty', 'expires_at']
+        read_only_fields = ['expires_at']
+        extra_kwargs = {'qty': {'min_value': 1}}
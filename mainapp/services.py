@@ -0,0 +1,275 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.db.models import F, Q, Case, When, ExpressionWrapper, BooleanField
+from django.db.models.functions import Coalesce
+from .models import Product, Purchase, PurchaseLine, Return, ReturnedLine, StockHold
+from . import catalog_cache, jobs, stock
+from accountsapp import wallet
+
+
+class PurchaseError(Exception):
+    message = 'Purchase is not possible'
+
+    def __init__(self, message=None):
+        super().__init__(message or self.message)
+
+
+class NotEnoughProducts(PurchaseError):
+    message = 'Not enough products in storage'
+
+
+class NotEnoughMoney(PurchaseError):
+    message = 'You dont have enough money'
+
+
+def with_returnable(queryset):
+    deadline = timezone.now() - timedelta(seconds=settings.RETURN_WINDOW_SECONDS)
+    return queryset.annotate(returnable=ExpressionWrapper(Q(create_at__gt=deadline), output_field=BooleanField()))
+
+
+def copy_purchase_lines(through, line_model, **filters):
+    # Creates the missing lines for purchase/product links; migration 0009 keeps its own copy of this.
+    existing = set(line_model.objects.filter(**filters).values_list('purchase_id', 'product_id'))
+    links = through.objects.filter(**filters).values_list(
+        'purchase_id', 'product_id', 'purchase__count', 'product__name', 'product__price'
+    )
+    return len(line_model.objects.bulk_create([
+        line_model(purchase_id=purchase_id, product_id=product_id, qty=count or 0, unit_price=price, product_name=name)
+        for purchase_id, product_id, count, name, price in links
+        if (purchase_id, product_id) not in existing
+    ]))
+
+
+def queue_sales(lines, kind='sold'):
+    # The daily totals are updated by a background job, so the request only pays for one insert.
+    lines = [
+        [int(line.product_id), line.qty, None if line.unit_price is None else str(line.unit_price)]
+        for line in lines if line.product_id
+    ]
+    if lines:
+        jobs.enqueue('sales.record', {'lines': lines, 'kind': kind, 'day': timezone.localdate().isoformat()})
+
+
+def positive_count(count):
+    count = int(count)
+    if count < 1:
+        raise PurchaseError('Count must be positive')
+    return count
+
+
+def take_stock(product_id, count):
+    taken = Product.objects.filter(
+        pk=product_id, price__isnull=False, stock_shards=0, count_in_storage__gte=count
+    ).update(count_in_storage=F('count_in_storage') - count, updated_at=timezone.now())
+    if taken:
+        catalog_cache.invalidate()
+        return
+    # Sharded products never write their Product row on purchase, so hot items do not queue on one lock.
+    shards = Product.objects.filter(
+        pk=product_id, price__isnull=False, stock_shards__gt=0
+    ).values_list('stock_shards', flat=True).first()
+    if not shards or not stock.take(product_id, shards, count):
+        raise NotEnoughProducts()
+
+
+def restock(quantities):
+    sharded = Product.objects.filter(pk__in=quantities, stock_shards__gt=0).values_list('pk', 'stock_shards')
+    placed = {product_id for product_id, shards in sharded if stock.put(product_id, shards, quantities[product_id])}
+    quantities = {pk: count for pk, count in quantities.items() if pk not in placed}
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(
+        count_in_storage=Case(
+            *[When(pk=pk, then=Coalesce(F('count_in_storage'), 0) + count) for pk, count in quantities.items()],
+            default=F('count_in_storage'),
+        ),
+        updated_at=timezone.now(),
+    )
+    catalog_cache.invalidate()
+
+
+def record_purchase(client, product_id, count):
+    # Writes the purchase for stock that is already taken and charges the client for it.
+    price, name = Product.objects.values_list('price', 'name').get(pk=product_id)
+    purchase = Purchase.objects.create(user=client, count=count)
+    # The product link is still written while older readers of the many-to-many are phased out.
+    Purchase.product.through.objects.create(purchase=purchase, product_id=product_id)
+    line = PurchaseLine.objects.create(
+        purchase=purchase, product_id=product_id, qty=count, unit_price=price, product_name=name
+    )
+    queue_sales([line])
+
+    # The wallet lock is taken last, so it is held for as short a time as possible.
+    if not wallet.debit(client.pk, price * count):
+        raise NotEnoughMoney()
+    return purchase
+
+
+def purchase_product(client, product_id, count):
+    count = positive_count(count)
+    with transaction.atomic():
+        take_stock(product_id, count)
+        return record_purchase(client, product_id, count)
+
+
+def reserve_stock(client, product_id, count):
+    count = positive_count(count)
+    with transaction.atomic():
+        take_stock(product_id, count)
+        return StockHold.objects.create(
+            client=client, product_id=product_id, qty=count,
+            expires_at=timezone.now() + timedelta(seconds=settings.STOCK_HOLD_SECONDS),
+        )
+
+
+def convert_hold(client, hold_id):
+    with transaction.atomic():
+        hold = StockHold.objects.select_for_update().filter(
+            pk=hold_id, client=client, expires_at__gt=timezone.now()
+        ).first()
+        if hold is None or not StockHold.objects.filter(pk=hold.pk).delete()[0]:
+            raise PurchaseError('Hold has expired')
+        return record_purchase(client, hold.product_id, hold.qty)
+
+
+def delete_holds(holds):
+    # Only the holds this call deleted are returned, so a hold that a concurrent sweeper or
+    # release_hold also read is restocked once; without SKIP LOCKED that race is real.
+    if not holds:
+        return []
+    if connection.features.can_return_columns_from_insert:
+        table = connection.ops.quote_name(StockHold._meta.db_table)
+        product, qty = (connection.ops.quote_name(StockHold._meta.get_field(name).column) for name in ('product', 'qty'))
+        placeholders = ', '.join(['%s'] * len(holds))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN ({placeholders}) RETURNING {product}, {qty}', [pk for pk, _, _ in holds]
+            )
+            return cursor.fetchall()
+    return [(product_id, qty) for pk, product_id, qty in holds if StockHold.objects.filter(pk=pk).delete()[0]]
+
+
+def release_hold(client, hold_id):
+    with transaction.atomic():
+        holds = list(StockHold.objects.filter(pk=hold_id, client=client).values_list('pk', 'product_id', 'qty'))
+        released = delete_holds(holds)
+        if not released:
+            return False
+        (product_id, qty), = released
+        restock({product_id: qty})
+    return True
+
+
+def release_expired_holds(chunk_size=1000):
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockHold.objects.filter(expires_at__lte=timezone.now()).order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                expired = expired.select_for_update(skip_locked=True)
+            holds = list(expired.values_list('pk', 'product_id', 'qty')[:chunk_size])
+            if not holds:
+                return released
+            deleted = delete_holds(holds)
+            quantities = defaultdict(int)
+            for product_id, qty in deleted:
+                quantities[product_id] += qty
+            restock(quantities)
+        released += len(deleted)
+
+
+def checkout_cart(client, items):
+    quantities = {}
+    for product_id, count in items:
+        count = int(count)
+        if count < 1:
+            raise PurchaseError('Count must be positive')
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + count
+    if not quantities:
+        raise PurchaseError('Cart is empty')
+
+    with transaction.atomic():
+        # Rows are read without a lock, so a hot sharded product never queues carts on its Product row;
+        # the guarded update below locks only the plain rows, and fails if one was sharded meanwhile.
+        products = list(Product.objects.filter(pk__in=quantities).order_by('pk'))
+        if len(products) != len(quantities) or any(product.price is None for product in products):
+            raise NotEnoughProducts()
+
+        sharded = {product.pk: product.stock_shards for product in products if product.stock_shards}
+        plain = {pk: count for pk, count in quantities.items() if pk not in sharded}
+        if plain:
+            in_stock = reduce(or_, [
+                Q(pk=pk, price__isnull=False, stock_shards=0, count_in_storage__gte=count) for pk, count in plain.items()
+            ])
+            taken = Product.objects.filter(in_stock).update(
+                count_in_storage=Case(
+                    *[When(pk=pk, then=F('count_in_storage') - count) for pk, count in plain.items()],
+                    default=F('count_in_storage'),
+                ),
+                updated_at=timezone.now(),
+            )
+            if taken != len(plain):
+                raise NotEnoughProducts()
+            catalog_cache.invalidate()
+        for product_id, shards in sharded.items():
+            if not stock.take(product_id, shards, quantities[product_id]):
+                raise NotEnoughProducts()
+
+        purchases = Purchase.objects.bulk_create([
+            Purchase(user=client, count=quantities[product.pk]) for product in products
+        ])
+        Purchase.product.through.objects.bulk_create([
+            Purchase.product.through(purchase_id=purchase.pk, product_id=product.pk)
+            for purchase, product in zip(purchases, products)
+        ])
+        lines = PurchaseLine.objects.bulk_create([
+            PurchaseLine(
+                purchase=purchase, product=product, qty=purchase.count,
+                unit_price=product.price, product_name=product.name,
+            )
+            for purchase, product in zip(purchases, products)
+        ])
+        queue_sales(lines)
+
+        total_cost = sum(product.price * quantities[product.pk] for product in products)
+        if not wallet.debit(client.pk, total_cost):
+            raise NotEnoughMoney()
+    return purchases
+
+
+def confirm_returns(return_ids):
+    with transaction.atomic():
+        returns = list(
+            Return.objects.select_for_update(of=('self',)).filter(pk__in=return_ids)
+            .select_related('purchase').prefetch_related('purchase__lines')
+        )
+        purchases = {return_obj.purchase.pk: return_obj.purchase for return_obj in returns if return_obj.purchase}
+        restocked = defaultdict(int)
+        refunds = defaultdict(Decimal)
+        lines = [line for purchase in purchases.values() for line in purchase.lines.all()]
+        queue_sales(lines, 'returned')
+        ReturnedLine.objects.bulk_create([
+            ReturnedLine(
+                product_id=line.product_id, qty=line.qty, unit_price=line.unit_price,
+                purchased_at=purchase.create_at,
+            )
+            for purchase in purchases.values() for line in purchase.lines.all()
+        ])
+        for purchase in purchases.values():
+            for line in purchase.lines.all():
+                if line.product_id:
+                    restocked[line.product_id] += line.qty
+                if purchase.user_id:
+                    refunds[purchase.user_id] += line.qty * (line.unit_price or 0)
+
+        restock(restocked)
+        wallet.credit_many(refunds)
+        Purchase.objects.filter(pk__in=purchases).delete()
+        Return.objects.filter(pk__in=[return_obj.pk for return_obj in returns]).delete()
+    return len(returns)
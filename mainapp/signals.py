@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Product, Purchase, PurchaseLine
+from .services import copy_purchase_lines
+from . import catalog_cache
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    catalog_cache.invalidate()
+
+
+@receiver(m2m_changed, sender=Purchase.product.through)
+def sync_purchase_lines(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keeps lines in step with code that still edits Purchase.product directly, e.g. the admin.
+    side, other = ('product_id', 'purchase_id') if reverse else ('purchase_id', 'product_id')
+    if action == 'post_add' and pk_set:
+        copy_purchase_lines(sender, PurchaseLine, **{side: instance.pk, f'{other}__in': pk_set})
+    elif action == 'post_remove' and pk_set:
+        PurchaseLine.objects.filter(**{side: instance.pk, f'{other}__in': pk_set}).delete()
+    elif action == 'post_clear':
+        PurchaseLine.objects.filter(**{side: instance.pk}).delete()
@@ -0,0 +1,133 @@
+import random
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Product, StockShard
+from . import catalog_cache, jobs
+
+
+TOTAL_KEY = 'stock:total:%s'
+REFRESH_KEY = 'stock:refresh:%s'
+
+
+def split(total, shards):
+    return [total // shards + (index < total % shards) for index in range(shards)]
+
+
+def schedule_refresh(product_id):
+    # The count_in_storage snapshot is refreshed by a job at most once per STOCK_TOTAL_CACHE_SECONDS,
+    # late enough to include every change made in that window.
+    if cache.add(REFRESH_KEY % product_id, True, settings.STOCK_TOTAL_CACHE_SECONDS):
+        jobs.enqueue('stock.refresh', {'product_id': product_id}, delay=settings.STOCK_TOTAL_CACHE_SECONDS)
+
+
+def take(product_id, shards, count):
+    taken = _take(product_id, shards, count)
+    schedule_refresh(product_id)
+    return taken
+
+
+def _take(product_id, shards, count):
+    # A random first shard spreads concurrent buyers over different rows; the others are tried before giving up.
+    first = random.randrange(shards)
+    for offset in range(shards):
+        index = (first + offset) % shards
+        if StockShard.objects.filter(product_id=product_id, index=index, count__gte=count).update(count=F('count') - count):
+            return True
+    # No single shard holds enough, so they are locked together and drained in index order.
+    rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+    if sum(row.count for row in rows) < count:
+        return False
+    for row in rows:
+        taken = min(row.count, count)
+        row.count -= taken
+        count -= taken
+    StockShard.objects.bulk_update(rows, ['count'])
+    return True
+
+
+def put(product_id, shards, count):
+    # Returns False when the product is no longer sharded, so the caller restocks the product row instead.
+    if not StockShard.objects.filter(product_id=product_id, index=random.randrange(shards)).update(count=F('count') + count):
+        # The shards were changed meanwhile; set_shards holds the product row lock until it is done.
+        if not Product.objects.select_for_update().filter(pk=product_id, stock_shards__gt=0).exists():
+            return False
+        StockShard.objects.filter(product_id=product_id, index=0).update(count=F('count') + count)
+    schedule_refresh(product_id)
+    return True
+
+
+def refresh(product_id):
+    stock = StockShard.objects.filter(product_id=product_id).aggregate(total=Sum('count'))['total'] or 0
+    updated = Product.objects.filter(pk=product_id, stock_shards__gt=0).exclude(count_in_storage=stock).update(
+        count_in_storage=stock, updated_at=timezone.now(),
+    )
+    if updated:
+        catalog_cache.invalidate()
+    cache.set(TOTAL_KEY % product_id, stock, settings.STOCK_TOTAL_CACHE_SECONDS)
+    return stock
+
+
+def total(product_id):
+    def read():
+        product = Product.objects.values_list('stock_shards', 'count_in_storage').get(pk=product_id)
+        if not product[0]:
+            return product[1] or 0
+        return StockShard.objects.filter(product_id=product_id).aggregate(total=Sum('count'))['total'] or 0
+    return cache.get_or_set(TOTAL_KEY % product_id, read, settings.STOCK_TOTAL_CACHE_SECONDS)
+
+
+def set_shards(product_id, shards):
+    # Moves the product's stock into shards sub-rows, or back into count_in_storage when shards is 0.
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        rows = StockShard.objects.select_for_update().filter(product_id=product_id)
+        if product.stock_shards:
+            stock = sum(rows.values_list('count', flat=True))
+        else:
+            stock = product.count_in_storage or 0
+        rows.delete()
+        StockShard.objects.bulk_create([
+            StockShard(product_id=product_id, index=index, count=count)
+            for index, count in enumerate(split(stock, shards) if shards else [])
+        ])
+        Product.objects.filter(pk=product_id).update(stock_shards=shards, count_in_storage=stock, updated_at=timezone.now())
+        catalog_cache.invalidate()
+    cache.delete(TOTAL_KEY % product_id)
+    return stock
+
+
+def set_stock(product_id, count):
+    # An edited stock level replaces the shards' contents, spread evenly again.
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+        for row, share in zip(rows, split(count, product.stock_shards or 1)):
+            row.count = share
+        StockShard.objects.bulk_update(rows, ['count'])
+        Product.objects.filter(pk=product_id).update(count_in_storage=count, updated_at=timezone.now())
+        catalog_cache.invalidate()
+    cache.delete(TOTAL_KEY % product_id)
+
+
+def rebalance(product_ids=None):
+    # Spreads each sharded product's stock evenly again and refreshes its count_in_storage snapshot.
+    products = Product.objects.filter(stock_shards__gt=0).order_by('pk')
+    if product_ids:
+        products = products.filter(pk__in=product_ids)
+    rebalanced = 0
+    for product_id in products.values_list('pk', flat=True).iterator():
+        with transaction.atomic():
+            rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+            stock = sum(row.count for row in rows)
+            for row, count in zip(rows, split(stock, len(rows) or 1)):
+                row.count = count
+            StockShard.objects.bulk_update(rows, ['count'])
+            Product.objects.filter(pk=product_id).update(count_in_storage=stock, updated_at=timezone.now())
+        cache.set(TOTAL_KEY % product_id, stock, settings.STOCK_TOTAL_CACHE_SECONDS)
+        rebalanced += 1
+    if rebalanced:
+        catalog_cache.invalidate()
+    return rebalanced
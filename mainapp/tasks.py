@@ -0,0 +1,22 @@
+from datetime import date
+from decimal import Decimal
+from .jobs import task
+from .models import PurchaseLine
+from . import sales, stock
+
+
+@task('sales.record')
+def record_sales(lines, kind='sold', day=None):
+    sales.add(
+        [
+            PurchaseLine(product_id=product_id, qty=qty, unit_price=None if price is None else Decimal(price))
+            for product_id, qty, price in lines
+        ],
+        kind,
+        date.fromisoformat(day) if day else None,
+    )
+
+
+@task('stock.refresh')
+def refresh_stock(product_id):
+    stock.refresh(product_id)
@@ -1,9 +1,11 @@
-from django.test import TestCase, Client, RequestFactory
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import Purchase, Product, Return
+from .models import Purchase, Product, Return, PurchaseLine, SalesDaily, Job, StockHold, StockShard
+from .jobs import task, enqueue, claim, run, release_stale
 from accountsapp.models import Client
-from .views import PurchaseListView, ReturnConfirmView, PurchaseModelViewSet, ReturnModelViewSet
+from accountsapp import wallet
+from .views import ProductListView, PurchaseListView, ReturnConfirmView, PurchaseModelViewSet, ReturnModelViewSet, ProductModelViewSet, ClientModelViewSet, StockHoldViewSet
 from decimal import Decimal
 from django.contrib import messages
 from django.contrib.messages import get_messages
@@ -14,8 +16,27 @@ from .serializers import ProductSerializer, PurchaseSerializer, ReturnSerializer
 from rest_framework.serializers import ValidationError
 from rest_framework.test import APIRequestFactory
 import json
+import time
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from rest_framework.authtoken.models import Token
 from django.utils import timezone
+from django.core.management import call_command
+from io import StringIO
+from django.db import connection, OperationalError
+from django.db.models import Sum, QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from mainapp import catalog_cache, stock
+from .services import purchase_product, checkout_cart, confirm_returns, copy_purchase_lines, reserve_stock, convert_hold, release_hold, release_expired_holds, delete_holds, PurchaseError, NotEnoughProducts, NotEnoughMoney
+from asgiref.sync import async_to_sync, sync_to_async, iscoroutinefunction
+from .async_views import AsyncProductListView, AsyncProductPageView
+from .middleware import QueryTraceMiddleware, fingerprint
+from .db_router import ReplicaRouter, ReplicaMiddleware, PIN_COOKIE
+from django.http import HttpResponse
 
 
 class UnitPurchaseListViewTest(TestCase):
@@ -36,7 +57,7 @@ class UnitPurchaseListViewTest(TestCase):
         product = Product.objects.get(pk=self.product.pk)
         self.assertEqual(product.count_in_storage, 9)  
         user = Client.objects.get(user=self.user)
-        self.assertEqual(user.wallet, Decimal('90.00')) 
+        self.assertEqual(user.balance, Decimal('90.00')) 
 
 
 class IntegrationPurchaseListViewTest(TestCase):
@@ -55,10 +76,11 @@ class IntegrationPurchaseListViewTest(TestCase):
         product = Product.objects.get(pk=self.product.pk)
         self.assertEqual(product.count_in_storage, 9)
         user = Client.objects.get(user=self.user)
-        self.assertEqual(user.wallet, 10)
+        self.assertEqual(user.balance, 10)
         messages = list(get_messages(response.wsgi_request))
         self.assertEqual(len(messages), 1)
         self.assertEqual(str(messages[0]), 'Purchase completed successfully')
+        self.assertRegex(response.content.decode(), r'testuser 10(\.00)? - Test Product')
 
     def test_not_enough_products_in_storage(self):
         login = self.client.login(username='testuser', password='testpass')
@@ -305,7 +327,7 @@ class ReturnConfirmViewTest(TestCase):
         self.assertEqual(Return.objects.filter(id=self.return_obj.id).exists(), False)
         self.assertEqual(Purchase.objects.filter(id=self.purchase.id).exists(), False)
         updated_client = Client.objects.get(id=self.client.id)
-        self.assertEqual(updated_client.wallet, self.client.wallet + self.purchase.count * self.product.price)
+        self.assertEqual(updated_client.balance, self.client.wallet + self.purchase.count * self.product.price)
         updated_product = Product.objects.get(id=self.product.id)
         self.assertEqual(updated_product.count_in_storage, self.product.count_in_storage + self.purchase.count)
         self.assertEqual(response.status_code, 302) 
@@ -335,8 +357,7 @@ class PurchaseModelViewSetTestCase(TestCase):
         self.assertEqual(purchase.user, self.client)
         self.assertEqual(purchase.product.first(), self.product)
         self.assertEqual(purchase.count, 2)
-        self.client.refresh_from_db()
-        self.assertEqual(self.client.wallet, 80)
+        self.assertEqual(wallet.balance(self.client.pk), 80)
         self.product.refresh_from_db()
         self.assertEqual(self.product.count_in_storage, 18)
 
@@ -359,3 +380,1196 @@ class ReturnModelViewSetTest(TestCase):
         self.assertEqual(Return.objects.count(), 1)
 
 
+
+
+class PurchaseServiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client = Client.objects.create(user=self.user, wallet=50)
+        self.product = Product.objects.create(name='Test Product', price=10, count_in_storage=3)
+
+    def test_purchase_until_sold_out(self):
+        for _ in range(3):
+            purchase_product(self.client, self.product.pk, 1)
+        with self.assertRaises(NotEnoughProducts):
+            purchase_product(self.client, self.product.pk, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count_in_storage, 0)
+        self.assertEqual(wallet.balance(self.client.pk), 20)
+        self.assertEqual(Purchase.objects.count(), 3)
+
+    def test_not_enough_money_rolls_back_stock(self):
+        wallet.set_balance(self.client.pk, 15)
+        with self.assertRaises(NotEnoughMoney):
+            purchase_product(self.client, self.product.pk, 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count_in_storage, 3)
+        self.assertEqual(Purchase.objects.count(), 0)
+
+
+class BenchPurchaseCommandTest(TransactionTestCase):
+    def test_bench_purchase_command(self):
+        out = StringIO()
+        call_command('bench_purchase', threads=1, attempts=5, stock=3, stdout=out)
+        self.assertIn('units sold: 3 of 3', out.getvalue())
+        self.assertIn('no oversell', out.getvalue())
+        self.assertFalse(Job.objects.exists())
+
+    def test_threads_do_not_oversell(self):
+        product = Product.objects.create(name='Raced', price=1, count_in_storage=10)
+        clients = [
+            Client.objects.create(user=User.objects.create_user(f'racer{i}'), wallet=100) for i in range(4)
+        ]
+        barrier = threading.Barrier(len(clients))
+
+        def buy(client):
+            bought = 0
+            try:
+                barrier.wait()
+                for _ in range(5):
+                    try:
+                        purchase_product(client, product.pk, 1)
+                        bought += 1
+                    except (NotEnoughProducts, OperationalError):
+                        pass
+            finally:
+                connection.close()
+            return bought
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            bought = sum(pool.map(buy, clients))
+        product.refresh_from_db()
+        sold = PurchaseLine.objects.filter(product=product).aggregate(units=Sum('qty'))['units'] or 0
+        self.assertEqual(sold, bought)
+        self.assertGreater(sold, 0)
+        self.assertLessEqual(sold, 10)
+        self.assertEqual(product.count_in_storage, 10 - sold)
+
+    def test_sharded_rounds(self):
+        out = StringIO()
+        call_command('bench_purchase', '--threads=1', '--attempts=5', '--stock=3', '--shards=0,4', stdout=out)
+        self.assertEqual(out.getvalue().count('no oversell'), 2)
+        self.assertIn('shards: 4, threads: 1', out.getvalue())
+        self.assertFalse(StockShard.objects.exists())
+
+
+class ShopBenchCommandTest(TransactionTestCase):
+    def test_report(self):
+        output = os.path.join(tempfile.mkdtemp(), 'report.json')
+        call_command(
+            'shopbench', threads=1, operations=20, products=5, mix='browse=1,buy=1,return=1,confirm=1',
+            output=output, stdout=StringIO(),
+        )
+        with open(output) as file:
+            report = json.load(file)
+        self.assertEqual(report['requests']['total']['errors'], 0)
+        self.assertGreater(report['requests']['confirm']['queries_per_request'], 0)
+        self.assertEqual(Product.objects.filter(name__startswith='shopbench_').count(), 0)
+        self.assertFalse(Job.objects.exists())
+
+
+class SeedShopCommandTest(TestCase):
+    def seed(self):
+        call_command(
+            'seed_shop', '--products', '1k', '--clients', '50', '--purchases', '2k', '--batch-size', '300', '--seed', '7',
+            stdout=StringIO(),
+        )
+
+    def test_seed(self):
+        Product.objects.all().delete()
+        self.seed()
+        self.assertEqual(Product.objects.count(), 1000)
+        self.assertEqual(Client.objects.filter(user__username__startswith='seed_7_').count(), 50)
+        self.assertEqual(Purchase.objects.count(), 2000)
+        self.assertEqual(Purchase.product.through.objects.count(), 2000)
+        purchase = Purchase.objects.order_by('create_at').first()
+        self.assertLess(purchase.create_at, timezone.now() - timedelta(days=30))
+        Product.objects.create(name='After seeding')
+
+    def test_deterministic(self):
+        Product.objects.all().delete()
+        self.seed()
+        first = list(Product.objects.order_by('pk').values_list('name', 'price', 'count_in_storage'))
+        Product.objects.all().delete()
+        self.seed()
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('name', 'price', 'count_in_storage')), first)
+
+
+class CheckoutTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client = Client.objects.create(user=self.user, wallet=1000)
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=10, count_in_storage=5) for i in range(5)
+        ]
+
+    def checkout(self, items):
+        data = {'items': [{'product': product.pk, 'count': count} for product, count in items]}
+        request = self.factory.post('/api/purchas/checkout/', data, format='json')
+        force_authenticate(request, user=self.user)
+        return PurchaseModelViewSet.as_view({'post': 'checkout'})(request)
+
+    def test_checkout_many_lines(self):
+        response = self.checkout([(self.products[0], 2), (self.products[1], 3), (self.products[0], 1)])
+        self.assertEqual(response.data['message'], 'Purchase completed successfully')
+        self.assertEqual(len(response.data['purchases']), 2)
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].count_in_storage, 2)
+        self.assertEqual(self.products[1].count_in_storage, 2)
+        self.assertEqual(wallet.balance(self.client.pk), 940)
+        purchase = Purchase.objects.get(product=self.products[0])
+        self.assertEqual(purchase.count, 3)
+
+    def test_checkout_is_all_or_nothing(self):
+        response = self.checkout([(self.products[0], 2), (self.products[1], 6)])
+        self.assertEqual(response.data['error'], 'Not enough products in storage')
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].count_in_storage, 5)
+        self.assertEqual(Purchase.objects.count(), 0)
+
+    def test_query_count_does_not_grow_with_cart(self):
+        with CaptureQueriesContext(connection) as one_line:
+            self.checkout([(self.products[0], 1)])
+        with CaptureQueriesContext(connection) as five_lines:
+            self.checkout([(product, 1) for product in self.products])
+        self.assertEqual(len(one_line), len(five_lines))
+
+
+class ListQueryCountTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.rows = 0
+
+    def add_rows(self, number):
+        for _ in range(number):
+            self.rows += 1
+            user = User.objects.create(username=f'user{self.rows}')
+            client = Client.objects.create(user=user)
+            product = Product.objects.create(name=f'Product {self.rows}', price=10, count_in_storage=5)
+            purchase = Purchase.objects.create(user=client, count=1)
+            purchase.product.add(product)
+            Return.objects.create(purchase=purchase)
+
+    def assertListQueries(self, viewset, number):
+        for rows in (2, 8):
+            self.add_rows(rows)
+            request = self.factory.get('/')
+            force_authenticate(request, user=self.admin)
+            with self.assertNumQueries(number):
+                response = viewset.as_view({'get': 'list'})(request)
+                response.render()
+            self.assertEqual(response.status_code, 200)
+
+    def test_product_list(self):
+        self.assertListQueries(ProductModelViewSet, 2)
+
+    def test_client_list(self):
+        self.assertListQueries(ClientModelViewSet, 1)
+
+    def test_purchase_list(self):
+        self.assertListQueries(PurchaseModelViewSet, 4)
+
+    def test_return_list(self):
+        self.assertListQueries(ReturnModelViewSet, 3)
+
+
+class ClientWalletApiTest(TestCase):
+    def test_wallet_edit_goes_through_ledger(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        client = Client.objects.create(user=user, wallet=100)
+        wallet.debit(client.pk, Decimal('40'))
+        request = APIRequestFactory().patch('/', {'wallet': '75.00'}, format='json')
+        force_authenticate(request, user=user)
+        response = ClientModelViewSet.as_view({'patch': 'partial_update'})(request, pk=client.pk)
+        self.assertEqual(response.data['wallet'], '75.00')
+        self.assertEqual(wallet.balance(client.pk), 75)
+        self.assertEqual(client.wallet_entries.get(kind='adjustment').amount, 15)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        Product.objects.all().delete()
+        self.products = [Product.objects.create(name=f'Product {i}', price=10, count_in_storage=5) for i in range(3)]
+
+    def test_product_list_pages(self):
+        response = self.client.get(reverse('products'), {'page_size': 2})
+        self.assertEqual(list(response.context['all_product_list']), self.products[:2])
+        self.assertIsNone(response.context['previous_link'])
+        Product.objects.create(name='Inserted meanwhile', price=10, count_in_storage=5)
+        response = self.client.get(response.context['next_link'])
+        self.assertEqual(response.context['all_product_list'][0], self.products[2])
+
+    def test_api_list_is_paginated(self):
+        factory = APIRequestFactory()
+        request = factory.get('/', {'page_size': 2})
+        response = ProductModelViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertNotIn('count', response.data)
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=100)
+        self.product = Product.objects.create(name='Cached', price=10, count_in_storage=5)
+
+    def list_products(self):
+        response = ProductModelViewSet.as_view({'get': 'list'})(self.factory.get('/api/products/'))
+        return {product['id']: product for product in response.data['results']}
+
+    def test_list_is_served_from_cache(self):
+        self.list_products()
+        with self.assertNumQueries(0):
+            self.list_products()
+        stats = catalog_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_product_save_invalidates(self):
+        self.list_products()
+        evictions = catalog_cache.stats()['evictions']
+        self.product.price = 12
+        self.product.save()
+        self.assertEqual(self.list_products()[self.product.pk]['price'], '12.00')
+        self.assertEqual(catalog_cache.stats()['evictions'], evictions + 1)
+
+    def test_purchase_invalidates(self):
+        self.list_products()
+        purchase_product(self.client_instance, self.product.pk, 2)
+        self.assertEqual(self.list_products()[self.product.pk]['count_in_storage'], 3)
+
+    def test_retrieve_is_served_from_cache(self):
+        view = ProductModelViewSet.as_view({'get': 'retrieve'})
+        for queries in (1, 0):
+            request = self.factory.get('/')
+            force_authenticate(request, user=self.user)
+            with self.assertNumQueries(queries):
+                response = view(request, pk=self.product.pk)
+            self.assertEqual(response.data['name'], 'Cached')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=100)
+        self.product = Product.objects.create(name='Tagged', price=10, count_in_storage=5)
+
+    def get(self, viewset, action='list', **headers):
+        request = self.factory.get('/', **headers)
+        force_authenticate(request, user=self.user)
+        kwargs = {'pk': self.product.pk} if action == 'retrieve' else {}
+        return viewset.as_view({'get': action})(request, **kwargs)
+
+    def test_product_list_not_modified(self):
+        etag = self.get(ProductModelViewSet)['ETag']
+        self.assertEqual(self.get(ProductModelViewSet, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        purchase_product(self.client_instance, self.product.pk, 1)
+        response = self.get(ProductModelViewSet, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_retrieve_if_modified_since(self):
+        last_modified = self.get(ProductModelViewSet, 'retrieve')['Last-Modified']
+        response = self.get(ProductModelViewSet, 'retrieve', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_purchase_list_not_modified(self):
+        purchase_product(self.client_instance, self.product.pk, 1)
+        etag = self.get(PurchaseModelViewSet)['ETag']
+        self.assertEqual(self.get(PurchaseModelViewSet, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        purchase_product(self.client_instance, self.product.pk, 1)
+        self.assertEqual(self.get(PurchaseModelViewSet, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_purchase_validators_follow_wallet(self):
+        purchase = purchase_product(self.client_instance, self.product.pk, 1)
+        etag = self.get(PurchaseModelViewSet)['ETag']
+        request = self.factory.get('/')
+        force_authenticate(request, user=self.user)
+        detail_etag = PurchaseModelViewSet.as_view({'get': 'retrieve'})(request, pk=purchase.pk)['ETag']
+        wallet.set_balance(self.client_instance.pk, 500)
+        self.assertEqual(self.get(PurchaseModelViewSet, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=detail_etag)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(PurchaseModelViewSet.as_view({'get': 'retrieve'})(request, pk=purchase.pk).status_code, 200)
+
+    def test_product_list_etag_is_shared(self):
+        etag = self.get(ProductModelViewSet)['ETag']
+        self.user = User.objects.create_user(username='other', password='testpass')
+        self.assertEqual(self.get(ProductModelViewSet, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_product_page_not_modified(self):
+        self.client.login(username='testuser', password='testpass')
+        url = reverse('product_detail', args=[self.product.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.tea = Product.objects.create(name='Green tea', text='Leaves from the mountains', price=5, count_in_storage=5)
+        self.cup = Product.objects.create(name='Cup', text='Good for green tea or coffee', price=3, count_in_storage=5)
+        Product.objects.create(name='Spoon', text='<b>Steel</b>', price=1, count_in_storage=5)
+
+    def search(self, **params):
+        response = ProductModelViewSet.as_view({'get': 'search'})(self.factory.get('/', params))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_and_highlighted(self):
+        results = self.search(q='tea')['results']
+        self.assertEqual([product['id'] for product in results], [self.tea.pk, self.cup.pk])
+        self.assertIn('<mark>tea</mark>', results[0]['headline'])
+
+    def test_highlight_escapes_text(self):
+        results = self.search(q='steel')['results']
+        self.assertEqual(results[0]['headline'], '&lt;b&gt;<mark>Steel</mark>&lt;/b&gt;')
+
+    def test_paging(self):
+        data = self.search(q='tea', page_size=1)
+        self.assertEqual(data['results'][0]['id'], self.tea.pk)
+        self.assertIn('offset=1', data['next'])
+        data = self.search(q='tea', page_size=1, offset=1)
+        self.assertEqual(data['results'][0]['id'], self.cup.pk)
+        self.assertIsNone(data['next'])
+
+    def test_index_follows_saves(self):
+        self.cup.name = 'Mug'
+        self.cup.text = 'Ceramic'
+        self.cup.save()
+        self.assertEqual([product['id'] for product in self.search(q='tea')['results']], [self.tea.pk])
+        self.assertEqual(self.search(q='ceramic')['results'][0]['id'], self.cup.pk)
+        self.tea.delete()
+        self.assertEqual(self.search(q='tea')['results'], [])
+
+    def test_product_list_page_search(self):
+        response = self.client.get(reverse('products'), {'q': 'mountains'})
+        self.assertEqual(list(response.context['all_product_list']), [self.tea])
+        self.assertContains(response, '<mark>mountains</mark>')
+
+
+class ProductFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.all().delete()
+        self.factory = APIRequestFactory()
+        self.cheap = Product.objects.create(name='Cheap', price=5, count_in_storage=0)
+        self.middle = Product.objects.create(name='Middle', price=40, count_in_storage=3)
+        self.pricey = Product.objects.create(name='Pricey', price=700, count_in_storage=1)
+        self.unpriced = Product.objects.create(name='Unpriced', count_in_storage=2)
+
+    def get(self, action='list', **params):
+        response = ProductModelViewSet.as_view({'get': action})(self.factory.get('/', params))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_range_in_stock_and_ordering(self):
+        results = self.get(min_price='10', in_stock='true', ordering='-price')['results']
+        self.assertEqual([product['name'] for product in results], ['Pricey', 'Middle'])
+
+    def test_price_ordering_pages(self):
+        data = self.get(ordering='price', page_size=2)
+        self.assertEqual([product['name'] for product in data['results']], ['Cheap', 'Middle'])
+        response = ProductModelViewSet.as_view({'get': 'list'})(self.factory.get(data['next']))
+        self.assertEqual([product['name'] for product in response.data['results']], ['Pricey'])
+
+    def test_ties_page_once(self):
+        for i in range(5):
+            Product.objects.create(name=f'Same {i}', price=20, count_in_storage=1)
+        seen = []
+        data = self.get(ordering='-price', min_price='20', max_price='20', page_size=2)
+        while True:
+            seen += [product['name'] for product in data['results']]
+            if not data['next']:
+                break
+            data = ProductModelViewSet.as_view({'get': 'list'})(self.factory.get(data['next'])).data
+        self.assertEqual(seen, [f'Same {i}' for i in reversed(range(5))])
+
+    def test_invalid_filter(self):
+        response = ProductModelViewSet.as_view({'get': 'list'})(self.factory.get('/', {'min_price': 'cheap'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = self.get('facets')
+        self.assertEqual((facets['total'], facets['in_stock'], facets['out_of_stock']), (4, 3, 1))
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [1, 1, 0, 0, 1])
+        self.assertEqual(self.get('facets', in_stock='true')['total'], 3)
+
+
+class PurgeExpiredTokensCommandTest(TestCase):
+    def setUp(self):
+        for i in range(5):
+            user = User.objects.create(username=f'user{i}')
+            token = Token.objects.create(user=user)
+            if i < 4:
+                Token.objects.filter(pk=token.pk).update(created=timezone.now() - timedelta(minutes=11))
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('purge_expired_tokens', dry_run=True, chunk_size=3, sleep=0, stdout=out)
+        self.assertIn('expired tokens would be deleted: 4', out.getvalue())
+        self.assertEqual(Token.objects.count(), 5)
+
+    def test_purge_in_chunks(self):
+        out = StringIO()
+        call_command('purge_expired_tokens', chunk_size=3, sleep=0, stdout=out)
+        self.assertIn('3 tokens deleted', out.getvalue())
+        self.assertIn('expired tokens deleted: 4', out.getvalue())
+        self.assertEqual(Token.objects.count(), 1)
+
+
+class RejectReturnsCommandTest(TestCase):
+    def setUp(self):
+        self.returns = {}
+        for name in ('alice', 'bob'):
+            client = Client.objects.create(user=User.objects.create(username=name))
+            purchase = Purchase.objects.create(user=client, count=1)
+            old = Return.objects.create(purchase=purchase)
+            Return.objects.filter(pk=old.pk).update(create_at=timezone.now() - timedelta(hours=2))
+            self.returns[name] = (old, Return.objects.create(purchase=purchase))
+
+    def call(self, **options):
+        out = StringIO()
+        call_command('reject_returns', chunk_size=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_reject_all(self):
+        self.assertIn('returns refused: 4', self.call())
+        self.assertFalse(Return.objects.exists())
+
+    def test_filters(self):
+        self.assertIn('returns refused: 1', self.call(older_than=60, user='alice'))
+        self.assertEqual(Return.objects.count(), 3)
+        self.assertFalse(Return.objects.filter(pk=self.returns['alice'][0].pk).exists())
+
+    def test_purchase_date_filter(self):
+        self.assertIn('returns refused: 0', self.call(purchased_before=timezone.now() - timedelta(days=1)))
+        self.assertIn('returns would be refused: 4', self.call(purchased_after='2000-01-01', dry_run=True))
+
+    def test_daemon(self):
+        with self.settings(RETURN_REVIEW_MINUTES=60):
+            output = self.call(daemon=True, runs=2, interval=0)
+        self.assertEqual(output.count('returns refused:'), 2)
+        self.assertEqual(Return.objects.count(), 2)
+
+
+class BulkReturnConfirmTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.products = [Product.objects.create(name=f'Product {i}', price=10 * (i + 1), count_in_storage=0) for i in range(2)]
+        self.clients = [Client.objects.create(user=User.objects.create(username=f'user{i}'), wallet=0) for i in range(2)]
+
+    def make_returns(self, number):
+        returns = []
+        for i in range(number):
+            purchase = Purchase.objects.create(user=self.clients[i % 2], count=i + 1)
+            purchase.product.add(self.products[i % 2])
+            returns.append(Return.objects.create(purchase=purchase).pk)
+        return returns
+
+    def confirm(self, ids, user=None):
+        request = self.factory.post('/', {'ids': ids}, format='json')
+        force_authenticate(request, user=user or self.admin)
+        return ReturnModelViewSet.as_view({'post': 'confirm'}, **ReturnModelViewSet.confirm.kwargs)(request)
+
+    def test_confirm_many(self):
+        ids = self.make_returns(4)
+        response = self.confirm(ids)
+        self.assertEqual(response.data['detail'], '4 returns confirmed')
+        self.assertFalse(Return.objects.exists())
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual([Product.objects.get(pk=p.pk).count_in_storage for p in self.products], [4, 6])
+        self.assertEqual([Client.objects.get(pk=c.pk).balance for c in self.clients], [40, 120])
+
+    def test_duplicate_returns_refund_once(self):
+        ids = self.make_returns(1)
+        ids.append(Return.objects.create(purchase=Purchase.objects.get()).pk)
+        self.confirm(ids)
+        self.assertEqual(Client.objects.get(pk=self.clients[0].pk).balance, 10)
+
+    def test_query_count_is_flat(self):
+        few_ids, many_ids = self.make_returns(2), self.make_returns(8)
+        with CaptureQueriesContext(connection) as few:
+            self.confirm(few_ids)
+        with CaptureQueriesContext(connection) as many:
+            self.confirm(many_ids)
+        self.assertEqual(len(few), len(many))
+
+    def test_only_superuser(self):
+        user = User.objects.create(username='customer')
+        self.assertEqual(self.confirm(self.make_returns(1), user=user).status_code, 403)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        Product.objects.all().delete()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=100)
+        self.products = [Product.objects.create(name=f'Async {i}', price=1, count_in_storage=5) for i in range(3)]
+        self.token = Token.objects.create(user=self.user)
+
+    async def test_product_api_pages(self):
+        response = await self.async_client.get('/async/products/', {'page_size': 2})
+        data = json.loads(response.content)
+        self.assertEqual([product['name'] for product in data['results']], ['Async 0', 'Async 1'])
+        response = await self.async_client.get(data['next'])
+        self.assertEqual([product['name'] for product in json.loads(response.content)['results']], ['Async 2'])
+
+    async def test_product_api_matches_drf_list(self):
+        params = {'ordering': '-name', 'page_size': 2}
+        response = await self.async_client.get('/async/products/', params)
+        expected = await sync_to_async(ProductModelViewSet.as_view({'get': 'list'}))(APIRequestFactory().get('/', params))
+        self.assertEqual(
+            [product['name'] for product in json.loads(response.content)['results']],
+            [product['name'] for product in expected.data['results']],
+        )
+        self.assertIn('cursor=', json.loads(response.content)['next'])
+        response = await self.async_client.get('/async/products/', {'min_price': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+        await self.async_client.get('/async/products/')
+        stats = await sync_to_async(catalog_cache.stats)()
+        await self.async_client.get('/async/products/')
+        self.assertEqual((await sync_to_async(catalog_cache.stats)())['hits'], stats['hits'] + 1)
+
+    async def test_product_api_retrieve_needs_auth(self):
+        url = f'/async/products/{self.products[0].pk}/'
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+        response = await self.async_client.get(url, headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(json.loads(response.content)['name'], 'Async 0')
+
+    async def test_purchase_api_only_own(self):
+        other = await Client.objects.acreate(user=await User.objects.acreate(username='other'), wallet=100)
+        await sync_to_async(purchase_product)(self.client_instance, self.products[0].pk, 1)
+        await sync_to_async(purchase_product)(other, self.products[0].pk, 1)
+        response = await self.async_client.get('/async/purchas/', headers={'Authorization': f'Token {self.token.key}'})
+        results = json.loads(response.content)['results']
+        self.assertEqual([purchase['user']['user'] for purchase in results], [self.user.pk])
+
+    def test_async_page_views(self):
+        self.client.login(username='testuser', password='testpass')
+        request = RequestFactory().get('/products/')
+        request.session = self.client.session
+        response = async_to_sync(AsyncProductListView.as_view())(request)
+        self.assertContains(response, 'Async 2')
+        request = RequestFactory().get('/products/', {'q': 'Async'})
+        request.session = self.client.session
+        with mock.patch('mainapp.views.search_page', return_value=(self.products[1:2], None, None)) as search:
+            response = async_to_sync(AsyncProductListView.as_view())(request)
+        search.assert_called_once()
+        self.assertContains(response, 'Async 1')
+        self.assertNotContains(response, 'Async 2')
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        response = async_to_sync(AsyncProductPageView.as_view())(request, pk=self.products[0].pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+
+
+@override_settings(QUERY_TRACE_SAMPLE_RATE=1.0, QUERY_TRACE_DUPLICATE_THRESHOLD=3)
+class QueryTraceMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=1000)
+        self.product = Product.objects.create(name='Traced', price=1, count_in_storage=10)
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('mainapp.requests', 'INFO') as logs:
+            response = self.client.get(reverse('products'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+;desc="request"')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'products')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(len(record['slowest']), 3)
+
+    def test_duplicate_queries_are_reported(self):
+        purchases = [purchase_product(self.client_instance, self.product.pk, 1) for _ in range(3)]
+
+        def view(request):
+            return HttpResponse(', '.join(str(Purchase.objects.get(pk=purchase.pk)) for purchase in purchases))
+
+        with self.assertLogs('mainapp.requests', 'WARNING') as logs:
+            QueryTraceMiddleware(view)(RequestFactory().get('/'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record['duplicates'])
+        self.assertGreaterEqual(record['duplicates'][0]['count'], 3)
+
+    def test_async_views_stay_async(self):
+        async def view(request):
+            product = await Product.objects.aget(pk=self.product.pk)
+            return HttpResponse(product.name)
+
+        middleware = QueryTraceMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('mainapp.requests', 'INFO'):
+            response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(QUERY_TRACE_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        self.assertFalse(self.client.get(reverse('products')).has_header('Server-Timing'))
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+
+
+class PurchaseLineTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=1000)
+        self.product = Product.objects.create(name='Lined', price=10, count_in_storage=20)
+
+    def test_purchase_records_line(self):
+        purchase = purchase_product(self.client_instance, self.product.pk, 2)
+        line = purchase.lines.get()
+        self.assertEqual((line.product_id, line.qty, line.unit_price, line.product_name), (self.product.pk, 2, 10, 'Lined'))
+
+    def test_refund_uses_paid_price(self):
+        purchase = purchase_product(self.client_instance, self.product.pk, 2)
+        Product.objects.filter(pk=self.product.pk).update(price=50, name='Renamed')
+        self.assertEqual(str(purchase), f'{self.client_instance} - Lined')
+        confirm_returns([Return.objects.create(purchase=purchase).pk])
+        self.assertEqual(wallet.balance(self.client_instance.pk), 1000)
+
+    def test_lines_follow_legacy_links(self):
+        purchase = Purchase.objects.create(user=self.client_instance, count=3)
+        purchase.product.add(self.product)
+        self.assertEqual(purchase.lines.get().qty, 3)
+        purchase.product.remove(self.product)
+        self.assertFalse(purchase.lines.exists())
+
+    def test_backfill(self):
+        purchases = Purchase.objects.bulk_create([Purchase(user=self.client_instance, count=i + 1) for i in range(3)])
+        Purchase.product.through.objects.bulk_create([
+            Purchase.product.through(purchase=purchase, product=self.product) for purchase in purchases
+        ])
+        PurchaseLine.objects.filter(purchase=purchases[0]).delete()
+        copy_purchase_lines(Purchase.product.through, PurchaseLine, purchase_id__gte=0)
+        self.assertEqual(PurchaseLine.objects.filter(purchase__in=purchases).count(), 3)
+        self.assertEqual(copy_purchase_lines(Purchase.product.through, PurchaseLine, purchase_id__gte=0), 0)
+
+    def test_purchase_list_reads_lines_only(self):
+        for _ in range(5):
+            purchase_product(self.client_instance, self.product.pk, 1)
+        request = self.factory.get('/')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = PurchaseModelViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(response.data['results'][0]['product'][0]['name'], 'Lined')
+        self.assertEqual(set(response.data['results'][0]['product'][0]), {'id', 'name', 'text', 'price', 'count_in_storage'})
+        self.assertEqual(dict(response.data['results'][0]['lines'][0]), {'id': self.product.pk, 'name': 'Lined', 'price': '10.00', 'qty': 1})
+        self.assertLessEqual(len(queries), 4)
+        self.assertFalse(any('mainapp_purchase_product' in query['sql'] for query in queries))
+
+
+@override_settings(JOBS_EAGER=True)
+class SalesDailyTest(TestCase):
+    def setUp(self):
+        Product.objects.all().delete()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=10000)
+        self.water = Product.objects.create(name='Water', price=2, count_in_storage=100)
+        self.coffee = Product.objects.create(name='Coffee', price=5, count_in_storage=100)
+
+    def top(self, **params):
+        request = self.factory.get('/', params)
+        return ProductModelViewSet.as_view({'get': 'top'})(request)
+
+    def test_purchases_and_returns_update_totals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase_product(self.client_instance, self.water.pk, 3)
+            checkout_cart(self.client_instance, [(self.water.pk, 2), (self.coffee.pk, 1)])
+            returned = purchase_product(self.client_instance, self.coffee.pk, 4)
+            confirm_returns([Return.objects.create(purchase=returned).pk])
+        water = SalesDaily.objects.get(product=self.water, day=timezone.localdate())
+        self.assertEqual((water.units, water.revenue), (5, 10))
+        coffee = SalesDaily.objects.get(product=self.coffee)
+        self.assertEqual((coffee.units, coffee.returned_units, coffee.refunded), (5, 4, 20))
+
+    def test_top_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase_product(self.client_instance, self.water.pk, 3)
+            purchase_product(self.client_instance, self.coffee.pk, 2)
+        with self.assertNumQueries(1):
+            response = self.top()
+        self.assertEqual([row['name'] for row in response.data['results']], ['Water', 'Coffee'])
+        response = self.top(order='revenue', limit=1)
+        self.assertEqual(response.data['results'], [{'id': self.coffee.pk, 'name': 'Coffee', 'units': 2, 'revenue': 10}])
+        self.assertEqual(self.top(start='2020-01-02', end='2020-01-01').status_code, 400)
+
+    def test_rebuild(self):
+        purchase_product(self.client_instance, self.water.pk, 3)
+        old = purchase_product(self.client_instance, self.coffee.pk, 2)
+        Purchase.objects.filter(pk=old.pk).update(create_at=timezone.now() - timedelta(days=40))
+        SalesDaily.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_sales', stdout=out)
+        self.assertIn('daily sales rebuilt: 2 rows', out.getvalue())
+        self.assertEqual(
+            SalesDaily.objects.get(product=self.coffee).day, timezone.localdate() - timedelta(days=40)
+        )
+        self.assertEqual(SalesDaily.objects.get(product=self.water).units, 3)
+
+    def test_rebuild_matches_incremental_totals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase_product(self.client_instance, self.water.pk, 3)
+            returned = purchase_product(self.client_instance, self.coffee.pk, 4)
+            purchase_product(self.client_instance, self.coffee.pk, 1)
+            confirm_returns([Return.objects.create(purchase=returned).pk])
+        columns = ('day', 'product_id', 'units', 'revenue', 'returned_units', 'refunded')
+        incremental = set(SalesDaily.objects.values_list(*columns))
+        call_command('rebuild_sales', stdout=StringIO())
+        self.assertEqual(set(SalesDaily.objects.values_list(*columns)), incremental)
+        coffee = SalesDaily.objects.get(product=self.coffee)
+        self.assertEqual((coffee.units, coffee.returned_units, coffee.refunded), (5, 4, 20))
+
+    def test_eager_jobs_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            purchase_product(self.client_instance, self.water.pk, 3)
+            self.assertFalse(SalesDaily.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(SalesDaily.objects.get(product=self.water).units, 3)
+
+
+class ReturnWindowTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=1000)
+        self.product = Product.objects.create(name='Windowed', price=1, count_in_storage=100)
+        self.client.login(username='testuser', password='testpass')
+
+    def buy(self, times, age=0):
+        purchases = [purchase_product(self.client_instance, self.product.pk, 1) for _ in range(times)]
+        Purchase.objects.filter(pk__in=[purchase.pk for purchase in purchases]).update(
+            create_at=timezone.now() - timedelta(seconds=age)
+        )
+        return purchases
+
+    def test_purchases_page_queries_do_not_grow(self):
+        self.buy(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('purchases'))
+        self.buy(5)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('purchases'))
+        self.assertEqual(len(many), len(few))
+
+    def test_return_button_only_inside_window(self):
+        self.buy(1, age=500)
+        self.buy(1)
+        response = self.client.get(reverse('purchases'))
+        self.assertEqual(response.content.decode().count('name="return_button"'), 1)
+
+    @override_settings(RETURN_WINDOW_SECONDS=600)
+    def test_window_setting(self):
+        purchase, = self.buy(1, age=500)
+        self.client.post(reverse('returns'), {'purchase_id': purchase.pk})
+        self.assertEqual(Return.objects.count(), 1)
+
+    def test_returns_page_queries_do_not_grow(self):
+        Return.objects.create(purchase=self.buy(1)[0])
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('returns'))
+        for purchase in self.buy(5):
+            Return.objects.create(purchase=purchase)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('returns'))
+        self.assertEqual(len(many), len(few))
+
+
+
+@override_settings(REPLICA_DATABASES=['replica'], PRIMARY_PIN_SECONDS=5)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def route(self, request, view=ProductListView.as_view()):
+        seen = {}
+
+        def handler(request):
+            middleware.process_view(request, view, (), {})
+            seen['db'] = ReplicaRouter().db_for_read(Product)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(handler)
+        response = middleware(request)
+        return seen['db'], response
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.route(self.factory.get('/'))[0], 'replica')
+        self.assertEqual(self.route(self.factory.get('/'), ProductModelViewSet.as_view({'get': 'list'}))[0], 'replica')
+        self.assertIsNone(ReplicaRouter().db_for_read(Product))
+
+    def test_other_views_and_writes_use_primary(self):
+        self.assertIsNone(self.route(self.factory.get('/'), PurchaseListView.as_view())[0])
+        db, response = self.route(self.factory.post('/'))
+        self.assertIsNone(db)
+        self.assertEqual(ReplicaRouter().db_for_write(Product), 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_reads_stick_to_primary_after_write(self):
+        _, response = self.route(self.factory.post('/'))
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.assertIsNone(self.route(request)[0])
+        request.COOKIES[PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.route(request)[0], 'replica')
+
+    def test_accounts_and_sessions_use_primary(self):
+        seen = {}
+
+        def handler(request):
+            middleware.process_view(request, ProductListView.as_view(), (), {})
+            seen['models'] = [ReplicaRouter().db_for_read(model) for model in (User, Client, Token, Product)]
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(handler)
+        middleware(self.factory.get('/'))
+        self.assertEqual(seen['models'], [None, None, None, 'replica'])
+
+    def test_catalog_cache_fills_from_primary(self):
+        seen = []
+
+        def handler(request):
+            middleware.process_view(request, ProductListView.as_view(), (), {})
+            seen.append(catalog_cache.get_or_set('test', time.time_ns(), lambda: ReplicaRouter().db_for_read(Product)))
+            seen.append(ReplicaRouter().db_for_read(Product))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(handler)
+        middleware(self.factory.get('/'))
+        self.assertEqual(seen, [None, 'replica'])
+
+    def test_async_chain(self):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.post('/'))
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'mainapp'))
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'mainapp'))
+
+
+@task('test.fail')
+def failing_job(times):
+    if Job.objects.filter(name='test.fail', attempts__lt=times + 1, status=Job.RUNNING).exists():
+        raise ValueError('boom')
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=1000)
+        self.product = Product.objects.create(name='Queued', price=2, count_in_storage=10)
+
+    def test_purchase_enqueues_sales(self):
+        purchase_product(self.client_instance, self.product.pk, 3)
+        self.assertFalse(SalesDaily.objects.exists())
+        job, = claim('test', batch_size=5)
+        self.assertTrue(run(job))
+        self.assertEqual(SalesDaily.objects.get(product=self.product).units, 3)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+
+    def test_deleted_products_are_skipped(self):
+        other = Product.objects.create(name='Kept', price=1, count_in_storage=10)
+        checkout_cart(self.client_instance, [(self.product.pk, 1), (other.pk, 2)])
+        Purchase.objects.all().delete()
+        self.product.delete()
+        job, = claim('test', batch_size=5)
+        self.assertTrue(run(job))
+        self.assertEqual(SalesDaily.objects.get().units, 2)
+
+    def test_priority_and_batches(self):
+        low = enqueue('sales.record', {'lines': []})
+        high = enqueue('sales.record', {'lines': []}, priority=5)
+        later = enqueue('sales.record', {'lines': []}, priority=9, delay=60)
+        self.assertEqual(claim('test', batch_size=1), [high])
+        self.assertEqual(claim('test', batch_size=5), [low])
+        self.assertEqual(claim('test', batch_size=5), [])
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    @override_settings(JOBS_RETRY_BASE_SECONDS=10)
+    def test_retry_with_backoff(self):
+        job = enqueue('test.fail', {'times': 5}, max_attempts=2)
+        self.assertFalse(run(claim('test')[0]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertIn('boom', job.last_error)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertFalse(run(claim('test')[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_stale_jobs_are_released(self):
+        job = enqueue('sales.record', {'lines': []})
+        claim('dead worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(release_stale(), 1)
+        self.assertEqual(claim('test'), [job])
+
+    def test_reclaimed_job_commits_once(self):
+        enqueue('sales.record', {'lines': [[self.product.pk, 2, '2.00']]})
+        slow, = claim('slow worker')
+        Job.objects.filter(pk=slow.pk).update(locked_at=timezone.now() - timedelta(days=1))
+        release_stale()
+        fast, = claim('test')
+        self.assertTrue(run(fast))
+        self.assertFalse(run(slow))
+        self.assertEqual(SalesDaily.objects.get(product=self.product).units, 2)
+        fast.refresh_from_db()
+        self.assertEqual(fast.status, Job.DONE)
+
+    def test_reclaimed_job_failure_is_ignored(self):
+        job = enqueue('test.fail', {'times': 5})
+        slow, = claim('slow worker')
+        Job.objects.filter(pk=slow.pk).update(locked_at=timezone.now() - timedelta(days=1))
+        release_stale()
+        fast, = claim('test')
+        self.assertFalse(run(slow))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.last_error), (Job.RUNNING, 'test', ''))
+
+
+@override_settings(JOBS_RETRY_BASE_SECONDS=0)
+class RunJobsCommandTest(TransactionTestCase):
+    def test_threads_drain_queue(self):
+        product = Product.objects.create(name='Drained', price=1, count_in_storage=10)
+        for _ in range(20):
+            enqueue('sales.record', {'lines': [[product.pk, 1, '1.00']]})
+        out = StringIO()
+        call_command('run_jobs', threads=4, batch_size=3, poll=0.01, once=True, stdout=out, stderr=StringIO())
+        self.assertIn('jobs done: 20', out.getvalue())
+        self.assertEqual(SalesDaily.objects.get(product=product).units, 20)
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+
+@override_settings(JOBS_EAGER=True)
+class StockHoldTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=100)
+        self.product = Product.objects.create(name='Held', price=10, count_in_storage=5)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.count_in_storage
+
+    def expire(self, *holds):
+        StockHold.objects.filter(pk__in=[hold.pk for hold in holds]).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_reserve_takes_stock(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 3)
+        self.assertEqual(self.stock(), 2)
+        self.assertGreater(hold.expires_at, timezone.now())
+        with self.assertRaises(NotEnoughProducts):
+            reserve_stock(self.client_instance, self.product.pk, 3)
+        self.assertEqual(StockHold.objects.count(), 1)
+
+    def test_convert_hold(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 2)
+        purchase = convert_hold(self.client_instance, hold.pk)
+        self.assertEqual(purchase.lines.get().qty, 2)
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(wallet.balance(self.client_instance.pk), 80)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_convert_without_money_keeps_hold(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 5)
+        wallet.set_balance(self.client_instance.pk, 10)
+        with self.assertRaises(NotEnoughMoney):
+            convert_hold(self.client_instance, hold.pk)
+        self.assertTrue(StockHold.objects.filter(pk=hold.pk).exists())
+        self.assertEqual(Purchase.objects.count(), 0)
+
+    def test_expired_hold_cannot_convert(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 2)
+        self.expire(hold)
+        with self.assertRaises(PurchaseError):
+            convert_hold(self.client_instance, hold.pk)
+        self.assertEqual(Purchase.objects.count(), 0)
+
+    def test_release_restores_stock(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 2)
+        other = Client.objects.create(user=User.objects.create_user(username='other', password='testpass'), wallet=0)
+        self.assertFalse(release_hold(other, hold.pk))
+        self.assertTrue(release_hold(self.client_instance, hold.pk))
+        self.assertEqual(self.stock(), 5)
+
+    def test_sweeper_releases_expired_holds(self):
+        second = Product.objects.create(name='Also held', price=1, count_in_storage=10)
+        holds = [reserve_stock(self.client_instance, self.product.pk, 1) for _ in range(3)]
+        holds += [reserve_stock(self.client_instance, second.pk, 4)]
+        kept = reserve_stock(self.client_instance, self.product.pk, 1)
+        self.expire(*holds)
+        self.assertEqual(release_expired_holds(chunk_size=2), 4)
+        self.assertEqual(self.stock(), 4)
+        second.refresh_from_db()
+        self.assertEqual(second.count_in_storage, 10)
+        self.assertEqual(list(StockHold.objects.all()), [kept])
+
+    def test_raced_holds_are_restocked_once(self):
+        hold = reserve_stock(self.client_instance, self.product.pk, 2)
+        stale = [(hold.pk, hold.product_id, hold.qty)]
+        self.assertEqual(delete_holds(stale), [(self.product.pk, 2)])
+        self.assertEqual(delete_holds(stale), [])
+        self.assertFalse(release_hold(self.client_instance, hold.pk))
+        with self.assertRaises(PurchaseError):
+            convert_hold(self.client_instance, hold.pk)
+        self.assertEqual(self.stock(), 3)
+
+    def test_release_expired_holds_command(self):
+        self.expire(reserve_stock(self.client_instance, self.product.pk, 2))
+        out = StringIO()
+        call_command('release_expired_holds', stdout=out)
+        self.assertIn('holds released: 1', out.getvalue())
+        self.assertEqual(self.stock(), 5)
+
+    def test_api(self):
+        request = self.factory.post('/holds/', {'product': self.product.pk, 'qty': 2}, format='json')
+        force_authenticate(request, user=self.user)
+        response = StockHoldViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), 3)
+
+        request = self.factory.post(f'/holds/{response.data["id"]}/purchase/')
+        force_authenticate(request, user=self.user)
+        response = StockHoldViewSet.as_view({'post': 'purchase'})(request, pk=response.data['id'])
+        self.assertEqual(response.data['message'], 'Purchase completed successfully')
+        self.assertTrue(Purchase.objects.filter(pk=response.data['purchase']).exists())
+
+        request = self.factory.post('/holds/', {'product': self.product.pk, 'qty': 9}, format='json')
+        force_authenticate(request, user=self.user)
+        response = StockHoldViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.data['error'], 'Not enough products in storage')
+
+
+@override_settings(JOBS_EAGER=True)
+class StockShardTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client_instance = Client.objects.create(user=self.user, wallet=1000)
+        self.product = Product.objects.create(name='Hot', price=1, count_in_storage=10)
+        cache.clear()
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('count', flat=True))
+
+    def test_set_shards_moves_stock(self):
+        self.assertEqual(stock.set_shards(self.product.pk, 3), 10)
+        self.assertEqual(self.shards(), [4, 3, 3])
+        self.assertEqual(stock.set_shards(self.product.pk, 0), 10)
+        self.assertEqual(self.shards(), [])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_shards, self.product.count_in_storage), (0, 10))
+
+    @override_settings(JOBS_EAGER=False)
+    def test_purchase_takes_from_shards_only(self):
+        stock.set_shards(self.product.pk, 4)
+        self.product.refresh_from_db()
+        updated_at = self.product.updated_at
+        for _ in range(7):
+            purchase_product(self.client_instance, self.product.pk, 1)
+        self.assertEqual(sum(self.shards()), 3)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.count_in_storage, self.product.updated_at), (10, updated_at))
+
+        refresh = Job.objects.get(name='stock.refresh')
+        self.assertGreater(refresh.run_at, timezone.now())
+        Job.objects.filter(pk=refresh.pk).update(run_at=timezone.now())
+        self.assertTrue(all(run(job) for job in claim('test', batch_size=20)))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count_in_storage, 3)
+
+    def test_put_survives_shard_changes(self):
+        stock.set_shards(self.product.pk, 4)
+        stock.set_shards(self.product.pk, 2)
+        with mock.patch('mainapp.stock.random.randrange', return_value=3):
+            self.assertTrue(stock.put(self.product.pk, 4, 5))
+        self.assertEqual(self.shards(), [10, 5])
+        stock.set_shards(self.product.pk, 0)
+        self.assertFalse(stock.put(self.product.pk, 2, 1))
+
+    def test_stock_edits_reach_the_shards(self):
+        admin = User.objects.create_superuser(username='admin', password='adminpass')
+        stock.set_shards(self.product.pk, 2)
+        request = APIRequestFactory().patch('/', {'count_in_storage': 7}, format='json')
+        force_authenticate(request, user=admin)
+        ProductModelViewSet.as_view({'patch': 'partial_update'})(request, pk=self.product.pk)
+        self.assertEqual(self.shards(), [4, 3])
+
+        self.client.force_login(admin)
+        data = {'name': 'Hot', 'text': '', 'price': '1.00', 'count_in_storage': 12}
+        self.client.post(reverse('update_product', args=[self.product.pk]), data)
+        self.assertEqual(self.shards(), [6, 6])
+        self.assertEqual(stock.total(self.product.pk), 12)
+
+    def test_large_purchase_drains_several_shards(self):
+        stock.set_shards(self.product.pk, 4)
+        purchase_product(self.client_instance, self.product.pk, 9)
+        self.assertEqual(sum(self.shards()), 1)
+        with self.assertRaises(NotEnoughProducts):
+            purchase_product(self.client_instance, self.product.pk, 2)
+        self.assertEqual(sum(self.shards()), 1)
+
+    def test_checkout_and_returns_use_shards(self):
+        other = Product.objects.create(name='Plain', price=1, count_in_storage=5)
+        stock.set_shards(self.product.pk, 2)
+        purchases = checkout_cart(self.client_instance, [(self.product.pk, 6), (other.pk, 2)])
+        self.assertEqual(sum(self.shards()), 4)
+        other.refresh_from_db()
+        self.assertEqual(other.count_in_storage, 3)
+        confirm_returns([Return.objects.create(purchase=purchase).pk for purchase in purchases])
+        self.assertEqual(sum(self.shards()), 10)
+        other.refresh_from_db()
+        self.assertEqual(other.count_in_storage, 5)
+
+    def test_checkout_does_not_lock_sharded_rows(self):
+        stock.set_shards(self.product.pk, 2)
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=QuerySet.select_for_update) as locks:
+            checkout_cart(self.client_instance, [(self.product.pk, 2)])
+        self.assertFalse([call for call in locks.call_args_list if call.args[0].model is Product])
+        self.assertEqual(sum(self.shards()), 8)
+
+    def test_rebalance_and_cached_total(self):
+        stock.set_shards(self.product.pk, 2)
+        self.assertEqual(stock.total(self.product.pk), 10)
+        StockShard.objects.filter(product=self.product, index=0).update(count=0)
+        self.assertEqual(stock.total(self.product.pk), 10)
+        self.assertEqual(stock.rebalance(), 1)
+        self.assertEqual(self.shards(), [3, 2])
+        self.assertEqual(stock.total(self.product.pk), 5)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count_in_storage, 5)
+
+    def test_shard_stock_command(self):
+        out = StringIO()
+        call_command('shard_stock', str(self.product.pk), '--shards=5', stdout=out)
+        self.assertIn('10 units in 5 shards', out.getvalue())
+        self.assertEqual(self.shards(), [2, 2, 2, 2, 2])
+        call_command('shard_stock', '--daemon', '--runs=2', '--interval=0', stdout=out)
+        self.assertEqual(out.getvalue().count('products rebalanced: 1'), 2)
@@ -1,6 +1,8 @@
 from .views import MainView, AboutView, ProductListView, ProductPageView, ProductCreateView, ProductUpdateView, ReturnListView, ReturnConfirmView, ReturnRejectView, PurchaseListView
+from .async_views import AsyncProductListView, AsyncProductPageView, AsyncPurchaseListView, AsyncProductApiView, AsyncPurchaseApiView
+from django.conf import settings
 from django.urls import path, include
-from mainapp.views import ProductModelViewSet, PurchaseModelViewSet, ReturnModelViewSet, ClientModelViewSet
+from mainapp.views import ProductModelViewSet, PurchaseModelViewSet, ReturnModelViewSet, ClientModelViewSet, StockHoldViewSet
 from rest_framework import routers
 
 
@@ -9,18 +11,27 @@ router.register('products', ProductModelViewSet)
 router.register('purchas', PurchaseModelViewSet)
 router.register('returns', ReturnModelViewSet)
 router.register('clients', ClientModelViewSet)
+router.register('holds', StockHoldViewSet, basename='stockhold')
+
+
+def pick(name, sync_view, async_view):
+    view = async_view if name in settings.ASYNC_VIEWS else sync_view
+    return view.as_view()
 
 
 urlpatterns = [
     path('/', include(router.urls)),
+    path('async/products/', AsyncProductApiView.as_view(), name = 'async_product_list'),
+    path('async/products/<int:pk>/', AsyncProductApiView.as_view(), name = 'async_product_detail'),
+    path('async/purchas/', AsyncPurchaseApiView.as_view(), name = 'async_purchase_list'),
     path('', MainView.as_view(), name = 'mainpage'),
     path('about/', AboutView.as_view(), name = 'about_shop'),
-    path('products/', ProductListView.as_view(), name = 'products'),
-    path('product/<int:pk>/', ProductPageView.as_view(), name = 'product_detail'),
+    path('products/', pick('products', ProductListView, AsyncProductListView), name = 'products'),
+    path('product/<int:pk>/', pick('product_detail', ProductPageView, AsyncProductPageView), name = 'product_detail'),
     path('product/create/', ProductCreateView.as_view(), name = 'create_product'),
     path('product/<int:pk>/update/', ProductUpdateView.as_view(), name = 'update_product'),
     path('returns/', ReturnListView.as_view(), name = 'returns'),
     path('returns/confirm/<int:return_id>/', ReturnConfirmView.as_view(), name='return_confirm'),
     path('returns/reject/<int:return_id>/', ReturnRejectView.as_view(), name='return_reject'),
-    path('purchases/', PurchaseListView.as_view(), name = 'purchases'),
+    path('purchases/', pick('purchases', PurchaseListView, AsyncPurchaseListView), name = 'purchases'),
 ]
\ No newline at end of file
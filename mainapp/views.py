@@ -1,5 +1,7 @@
-from .models import Product, Return, Purchase
-from accountsapp.models import Client
+from .models import Product, Return, Purchase, StockHold
+from accountsapp.models import Client, WalletEntry
+from accountsapp import wallet
+from django.db.models import Max, Prefetch, Subquery
 from django.views.generic import ListView, TemplateView, View, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404
@@ -7,14 +9,22 @@ from django.shortcuts import render
 from .forms import ProductForm
 from django.shortcuts import redirect
 from django.contrib import messages
-from datetime import datetime, timezone
-from django.db.models import F
-from .serializers import ProductSerializer, ReturnSerializer, PurchaseSerializer, ClientSerializer
+from functools import partial
+from .serializers import ProductSerializer, ReturnSerializer, PurchaseSerializer, ClientSerializer, CheckoutSerializer, SearchQuerySerializer, ReturnConfirmSerializer, TopProductsQuerySerializer, StockHoldSerializer, purchase_lines
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated
-from mainapp.permissions import ProductPermission
-from .filters import UserFilterBackend
+from mainapp.permissions import ProductPermission, IsSuperUser
+from .filters import UserFilterBackend, ProductFilterBackend
+from .conditional import ConditionalGetMixin, conditional_response, object_validators
+from .pagination import CursorPaginationMixin, CreatedCursorPagination
+from . import catalog_cache, sales, stock
+from .search import search_page
+from .services import purchase_product, checkout_cart, confirm_returns, with_returnable, reserve_stock, convert_hold, release_hold, PurchaseError
 
 
 class MainView(TemplateView):
@@ -25,19 +35,37 @@ class AboutView(TemplateView):
     template_name = "about.html"
 
 
-class ProductListView(ListView):
+class ProductListView(CursorPaginationMixin, ListView):
+    read_from_replica = True
     model = Product
     template_name = 'products.html'
     queryset = Product.objects.all()
     success_url = 'products'
     context_object_name = 'all_product_list'
 
+    def paginate_object_list(self, object_list):
+        query = SearchQuerySerializer(data=self.request.GET)
+        if query.is_valid():
+            paginate = partial(search_page, self.request, **query.validated_data)
+        else:
+            paginate = partial(super().paginate_object_list, object_list)
+        return catalog_cache.get_or_set('page', self.request.build_absolute_uri(), paginate)
+
+    def get_context_data(self, **kwargs):
+        kwargs['query'] = self.request.GET.get('q', '')
+        return super().get_context_data(**kwargs)
+
 
 class ProductPageView(LoginRequiredMixin, View):
+    read_from_replica = True
+
     def get(self, request, pk):
         product = get_object_or_404(Product, pk=pk)
         context = {'product': product}
-        return render(request, 'product_detail.html', context)
+        return conditional_response(
+            request, object_validators(product, request.user.pk),
+            lambda: render(request, 'product_detail.html', context),
+        )
 
 
 class ProductCreateView(LoginRequiredMixin, CreateView):
@@ -65,24 +93,32 @@ class ProductUpdateView(LoginRequiredMixin, UpdateView):
         initial['name'] = product.name
         initial['text'] = product.text
         initial['price'] = product.price
-        initial['count_in_storage'] = product.count_in_storage
+        initial['count_in_storage'] = stock.total(product.pk) if product.stock_shards else product.count_in_storage
         
         return initial
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # Sharded stock lives in the shard rows, so an edited count is spread over them.
+        if self.object.stock_shards and 'count_in_storage' in form.changed_data:
+            stock.set_stock(self.object.pk, form.cleaned_data['count_in_storage'] or 0)
+        return response
  
 
 class ReturnListView(LoginRequiredMixin, ListView):
     model = Return
     template_name = 'returns.html'
-    queryset = Return.objects.all()
+    queryset = Return.objects.select_related('purchase').prefetch_related(
+        Prefetch('purchase__user', queryset=wallet.with_balance(Client.objects.select_related('user'))), 'purchase__lines'
+    )
     context_object_name = 'all_returns_list'
 
     def post(self, request):
         purchase_id = request.POST.get('purchase_id')
 
-        purchase = Purchase.objects.get(pk=purchase_id)
-        now = datetime.now(timezone.utc)
+        purchase = with_returnable(Purchase.objects.all()).get(pk=purchase_id)
 
-        if (now - purchase.create_at).total_seconds() > 180:
+        if not purchase.returnable:
             messages.error(request, 'Return is no longer possible')
             return redirect('purchases')
 
@@ -96,16 +132,7 @@ class ReturnListView(LoginRequiredMixin, ListView):
 
 class ReturnConfirmView(View):
     def post(self, request, return_id):
-        return_obj = Return.objects.get(id=return_id)
-        for product in return_obj.purchase.product.all():
-            product.count_in_storage = F('count_in_storage') + return_obj.purchase.count
-            product.save()
-        all_price = return_obj.purchase.count * product.price
-        user = return_obj.purchase.user
-        user.wallet = F('wallet') + all_price
-        user.save()
-        return_obj.purchase.delete()
-        return_obj.delete()
+        confirm_returns([return_id])
         return redirect('returns')
 
 
@@ -116,96 +143,204 @@ class ReturnRejectView(View):
         return redirect('returns')
 
 
-class PurchaseListView(LoginRequiredMixin, ListView):
+class PurchaseListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Purchase
     template_name = 'purchases.html'
     context_object_name = 'all_purchases_list'
     success_url = 'purchases'
+    pagination_class = CreatedCursorPagination
     
     def get_queryset(self):
-        return Purchase.objects.filter(user__user=self.request.user)
+        queryset = Purchase.objects.filter(user__user=self.request.user).prefetch_related(
+            Prefetch('user', queryset=wallet.with_balance(Client.objects.select_related('user'))), 'lines'
+        )
+        return with_returnable(queryset)
 
     def post(self, request):
-        pk = request.POST.get('pk')
-        coun = request.POST.get('count')
-        product = Product.objects.get(pk=pk)
         user = Client.objects.get(user=request.user)
-        if product.count_in_storage < int(coun):
-            messages.error(request, 'Not enough products in storage')
-            return redirect('purchases')
-        total_cost = product.price * int(coun)
-        if total_cost > user.wallet:
-            messages.error(request, 'You dont have enough money')
+        try:
+            purchase_product(user, request.POST.get('pk'), request.POST.get('count'))
+        except PurchaseError as error:
+            messages.error(request, str(error))
             return redirect('purchases')
-        purchase = Purchase.objects.create(user=user, count=coun)
-        purchase.product.add(product)
-        purchase.create_at = datetime.now()
-        purchase.save()
-        product.count_in_storage = F('count_in_storage') - int(coun)
-        product.save()
-        user.wallet = F('wallet') - total_cost
-        user.save()
         messages.success(request, 'Purchase completed successfully')
 
         return redirect('purchases')
 
 
-class ProductModelViewSet(ModelViewSet):
+class ProductModelViewSet(ConditionalGetMixin, ModelViewSet):
+    read_from_replica = True
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [ProductPermission]
-    
-
-class PurchaseModelViewSet(ModelViewSet):
+    filter_backends = [ProductFilterBackend]
+    ordering = ['id']
+    # List validators are cached per URL, so they cannot depend on the user.
+    validators_per_user = False
+
+    def get_list_validators(self):
+        get_validators = super().get_list_validators
+        return catalog_cache.get_or_set('validators', self.request.build_absolute_uri(), get_validators)
+
+    def list_response(self, request, *args, **kwargs):
+        list_products = super().list_response
+        data = catalog_cache.get_or_set(
+            'list', request.build_absolute_uri(), lambda: list_products(request, *args, **kwargs).data
+        )
+        return Response(data)
+
+    def get_object(self):
+        if self.action != 'retrieve':
+            return super().get_object()
+        product = catalog_cache.get_or_set('product', self.kwargs['pk'], super().get_object)
+        self.check_object_permissions(self.request, product)
+        return product
+
+    @action(detail=False)
+    def search(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        products, next_link, previous_link = search_page(request, **query.validated_data)
+        results = [
+            dict(self.get_serializer(product).data, rank=product.rank, headline=product.headline)
+            for product in products
+        ]
+        return Response({'next': next_link, 'previous': previous_link, 'results': results})
+
+    @action(detail=False)
+    def facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        facets = catalog_cache.get_or_set(
+            'facets', request.build_absolute_uri(), lambda: ProductFilterBackend().get_facets(queryset)
+        )
+        return Response(facets)
+
+    @action(detail=False)
+    def top(self, request):
+        query = TopProductsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response({
+            'start': query.validated_data['start'],
+            'end': query.validated_data['end'],
+            'results': [
+                {'id': row['product_id'], 'name': row['product__name'], 'units': row['units'], 'revenue': row['revenue']}
+                for row in sales.top_products(**query.validated_data)
+            ],
+        })
+
+    @action(detail=False)
+    def cache_stats(self, request):
+        return Response(catalog_cache.stats())
+
+
+class PurchaseModelViewSet(ConditionalGetMixin, ModelViewSet):
+    read_from_replica = True
     serializer_class = PurchaseSerializer
     permission_classes = [IsAuthenticated]
-    queryset = Purchase.objects.all()
+    queryset = Purchase.objects.prefetch_related(
+        Prefetch('user', queryset=wallet.with_balance(Client.objects.all())), purchase_lines()
+    )
     filter_backends = [UserFilterBackend]
+    pagination_class = CreatedCursorPagination
+    validator_fields = ('updated_at', 'lines__product__updated_at')
+
+    # The nested client balance moves with wallet entries, not with the purchase row.
+    def get_validator_fields(self, queryset):
+        entries = WalletEntry.objects.filter(client_id__in=queryset.values('user_id')).order_by('-create_at')
+        return (*self.validator_fields, Subquery(entries.values('create_at')[:1]))
+
+    def get_object_stamps(self, instance):
+        entries = WalletEntry.objects.filter(client_id=instance.user_id)
+        products = [line.product.updated_at for line in instance.lines.all() if line.product is not None]
+        return [entries.aggregate(last=Max('create_at'))['last'], *products]
 
     def create(self, request, *args, **kwargs):
         product_id = request.data['product'][0].get('id')
-        count = int(request.data.get('count'))
-        product = Product.objects.get(pk=product_id)
         user = Client.objects.get(user=request.data['user']['user'])
-        if product.count_in_storage < int(count):
-            return Response({'error': 'Not enough products in storage'})
-        total_cost = product.price * int(count)
-        if total_cost > user.wallet:
-            return Response({'error': 'You dont have enough money'})
-        purchase = Purchase.objects.create(user=user, count=count)
-        purchase.product.add(product)
-        purchase.created_at = datetime.now()
-        purchase.save()
-        product.count_in_storage = F('count_in_storage') - int(count)
-        product.save()
-        user.wallet = F('wallet') - total_cost
-        user.save()
+        try:
+            purchase_product(user, product_id, request.data.get('count'))
+        except PurchaseError as error:
+            return Response({'error': str(error)})
         return Response({'message': 'Purchase completed successfully'})
 
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = [(item['product'], item['count']) for item in serializer.validated_data['items']]
+        user = Client.objects.get(user=request.user)
+        try:
+            purchases = checkout_cart(user, items)
+        except PurchaseError as error:
+            return Response({'error': str(error)})
+        return Response({
+            'message': 'Purchase completed successfully',
+            'purchases': [purchase.pk for purchase in purchases],
+        })
+
 
 class ReturnModelViewSet(ModelViewSet):
-    queryset = Return.objects.all()
+    read_from_replica = True
+    queryset = Return.objects.select_related('purchase').prefetch_related(
+        Prefetch('purchase__user', queryset=wallet.with_balance(Client.objects.all())), purchase_lines('purchase__lines')
+    )
     serializer_class = ReturnSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedCursorPagination
 
     def create(self, request, *args, **kwargs):
         purchase_id = request.data['purchase'].get('id')
-        purchase = Purchase.objects.get(pk=purchase_id)
-        now = datetime.now(timezone.utc)
-        
-        if (now - purchase.create_at).total_seconds() > 180:
+        purchase = with_returnable(Purchase.objects.all()).get(pk=purchase_id)
+
+        if not purchase.returnable:
             return Response({'detail': 'Return is no longer possible'})
 
         Return.objects.create(purchase=purchase)
 
         return Response({'detail': 'Return created successfully. Waiting for admin confirmation.'})
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    @action(detail=False, methods=['post'], permission_classes=[IsSuperUser])
+    def confirm(self, request):
+        serializer = ReturnConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        confirmed = confirm_returns(serializer.validated_data['ids'])
+        return Response({'detail': f'{confirmed} returns confirmed'})
 
 
 class ClientModelViewSet(ModelViewSet):
-    queryset = Client.objects.all()
-    serializer_class = ClientSerializer
\ No newline at end of file
+    read_from_replica = True
+    queryset = wallet.with_balance(Client.objects.all())
+    serializer_class = ClientSerializer
+
+class StockHoldViewSet(ModelViewSet):
+    serializer_class = StockHoldSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        return StockHold.objects.filter(client__user=self.request.user, expires_at__gt=timezone.now())
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        client = Client.objects.get(user=request.user)
+        try:
+            hold = reserve_stock(client, serializer.validated_data['product'].pk, serializer.validated_data['qty'])
+        except PurchaseError as error:
+            return Response({'error': str(error)})
+        return Response(self.get_serializer(hold).data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, *args, **kwargs):
+        client = Client.objects.get(user=request.user)
+        if not release_hold(client, kwargs['pk']):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def purchase(self, request, pk=None):
+        client = Client.objects.get(user=request.user)
+        try:
+            purchase = convert_hold(client, pk)
+        except PurchaseError as error:
+            return Response({'error': str(error)})
+        return Response({'message': 'Purchase completed successfully', 'purchase': purchase.pk})
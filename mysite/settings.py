@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mainapp.middleware.QueryTraceMiddleware',
+    'mainapp.db_router.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -91,6 +93,82 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Aliases from DATABASES that GET requests to views marked read_from_replica = True read from,
+# e.g. a second SQLite file or a second local Postgres database. A client that made a write
+# request reads from the primary for the next PRIMARY_PIN_SECONDS to hide replication lag.
+
+DATABASE_ROUTERS = ['mainapp.db_router.ReplicaRouter']
+REPLICA_DATABASES = []
+PRIMARY_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CATALOG_CACHE_TIMEOUT = 300
+
+RETURN_REVIEW_MINUTES = 24 * 60
+
+RETURN_WINDOW_SECONDS = 180
+
+# Stock reserved for checkout is released by release_expired_holds after this long.
+STOCK_HOLD_SECONDS = 600
+
+# Totals of sharded products are cached this long, and their count_in_storage snapshot
+# is refreshed by a stock.refresh job at most this long after a purchase or restock.
+STOCK_TOTAL_CACHE_SECONDS = 5
+
+
+# Wallet snapshots only cover ledger entries older than this, so slow transactions have committed.
+WALLET_COMPACT_GRACE_SECONDS = 300
+
+
+# Background jobs
+# Jobs are rows in the Job table, run by `manage.py run_jobs`. With JOBS_EAGER they run inline
+# as soon as the enqueuing transaction commits.
+# A failed job is retried after JOBS_RETRY_BASE_SECONDS, doubling up to JOBS_RETRY_MAX_SECONDS;
+# a job whose worker died is queued again once its lock is older than JOBS_LOCK_TIMEOUT_SECONDS.
+
+JOBS_EAGER = False
+JOBS_RETRY_BASE_SECONDS = 10
+JOBS_RETRY_MAX_SECONDS = 3600
+JOBS_LOCK_TIMEOUT_SECONDS = 600
+
+# Route names served by the async views in mainapp/async_views.py under ASGI:
+# 'products', 'product_detail' and 'purchases'.
+ASYNC_VIEWS = []
+
+
+# Request instrumentation
+# Sampled requests get a Server-Timing header and a JSON line on the 'mainapp.requests' logger.
+# The line is logged as a warning when the request or one of its queries is slow,
+# or when the same query shape repeats QUERY_TRACE_DUPLICATE_THRESHOLD times (N+1);
+# set the logger level to INFO to also log the sampled requests that look healthy.
+
+QUERY_TRACE_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+QUERY_TRACE_SLOW_REQUEST_MS = 500
+QUERY_TRACE_SLOW_QUERY_MS = 100
+QUERY_TRACE_TOP_QUERIES = 3
+QUERY_TRACE_DUPLICATE_THRESHOLD = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'mainapp.requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -143,6 +221,20 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
         'accountsapp.authentication.RembyTokenAuthentication',
-    ]
+        'accountsapp.authentication.SignedTokenAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'mainapp.pagination.ShopCursorPagination',
+    'PAGE_SIZE': 20,
+}
+TOKEN_EXPIRE_MINUTES = 10
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
+# Signed tokens are checked against every key listed here; new tokens use SIGNED_TOKEN_KEY_ID.
+# To rotate, add a new key, switch the id to it, and drop the old key after TOKEN_EXPIRE_MINUTES.
+SIGNED_TOKEN_KEYS = {
+    'k1': SECRET_KEY,
 }
+SIGNED_TOKEN_KEY_ID = 'k1'
+
 MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
\ No newline at end of file